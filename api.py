@@ -1,19 +1,32 @@
 import os
-import json
+import base64
 import uuid
 import hmac
 import hashlib
 import secrets
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import lru_cache, wraps
 
 from flask import Blueprint, request, jsonify, g, abort, current_app
 from flask_login import current_user
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
+from sqlalchemy import and_, bindparam, case, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
 
-from models import User, Project, ProjectTemplate, Team, TeamMember, ProjectVersion
+from models import User, Project, ProjectTemplate, Team, TeamMember, TeamProject, ProjectVersion
 from models import ApiClient, ApiToken, Webhook, WebhookEvent, Integration
+from models import ASSIGNABLE_TEAM_ROLES
 from app import db
+from performance import get_redis_client, get_cached, set_cached, clear_cache, incr_window_counter
+from security import SecurityManager
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -21,6 +34,361 @@ logger = logging.getLogger(__name__)
 # Create API blueprint
 api = Blueprint('api', __name__, url_prefix='/api/v1')
 
+@api.before_request
+def stamp_request_time():
+    """Take one timestamp per request for handlers to share"""
+    g.now = datetime.utcnow()
+    g.now_iso = g.now.isoformat()
+
+@api.after_request
+def add_etag(response):
+    """Tag successful GET responses and answer a matching If-None-Match with 304"""
+    if request.method == 'GET' and response.status_code == 200 and not response.direct_passthrough:
+        if 'ETag' not in response.headers:
+            response.set_etag(hashlib.blake2b(response.get_data(), digest_size=16).hexdigest())
+        response.make_conditional(request)
+    return response
+
+def _version_etag(*parts):
+    """Build an ETag from values that change whenever the resource does"""
+    source = ':'.join(str(part) for part in parts)
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+def _not_modified(etag):
+    """Return a 304 response if the client's cached copy matches etag, else None"""
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+# API usage counters are kept in Redis and flushed to the database periodically
+API_USAGE_KEY_PREFIX = 'api_usage:'
+API_USAGE_FLUSH_INTERVAL = 30  # seconds
+
+_usage_flusher_started = False
+_usage_flusher_lock = threading.Lock()
+
+def _pending_api_usage(user):
+    """Get API calls counted in Redis but not yet flushed to the database"""
+    redis_client = get_redis_client()
+    if redis_client is None:
+        return 0
+    return int(redis_client.get(f"{API_USAGE_KEY_PREFIX}{user.id}") or 0)
+
+def _record_api_usage(user):
+    """
+    Count one API call against the user's quota
+    Returns False if the quota is exceeded. With Redis configured this is a
+    single atomic INCR instead of a database write on every request.
+    """
+    redis_client = get_redis_client()
+    if redis_client is None:
+        if (user.api_usage_count or 0) >= user.api_quota:
+            return False
+        user.api_usage_count = (user.api_usage_count or 0) + 1
+        db.session.commit()
+        return True
+    
+    key = f"{API_USAGE_KEY_PREFIX}{user.id}"
+    pending = redis_client.incr(key)
+    if (user.api_usage_count or 0) + pending > user.api_quota:
+        redis_client.decr(key)
+        return False
+    
+    _start_usage_flusher()
+    return True
+
+def flush_api_usage_counters():
+    """Drain the Redis API usage counters into User.api_usage_count"""
+    redis_client = get_redis_client()
+    if redis_client is None:
+        return 0
+    
+    updates = []
+    for key in redis_client.scan_iter(match=f"{API_USAGE_KEY_PREFIX}*"):
+        # GETDEL rather than resetting to 0, so idle users leave no key behind
+        pending = int(redis_client.getdel(key) or 0)
+        if pending:
+            user_id = int(key.decode().split(':', 1)[1])
+            updates.append({"uid": user_id, "pending": pending})
+    
+    if updates:
+        users = User.__table__
+        db.session.execute(
+            update(users)
+            .where(users.c.id == bindparam('uid'))
+            .values(api_usage_count=func.coalesce(users.c.api_usage_count, 0) + bindparam('pending')),
+            updates
+        )
+        db.session.commit()
+    
+    return len(updates)
+
+def _start_usage_flusher():
+    """Start the background thread that flushes API usage counters"""
+    global _usage_flusher_started
+    if _usage_flusher_started:
+        return
+    
+    with _usage_flusher_lock:
+        if _usage_flusher_started:
+            return
+        
+        app = current_app._get_current_object()
+        
+        def flush_job():
+            while True:
+                time.sleep(API_USAGE_FLUSH_INTERVAL)
+                with app.app_context():
+                    try:
+                        flush_api_usage_counters()
+                    except Exception as e:
+                        db.session.rollback()
+                        logger.error(f"Error flushing API usage counters: {str(e)}")
+        
+        thread = threading.Thread(target=flush_job)
+        thread.daemon = True
+        thread.start()
+        _usage_flusher_started = True
+
+# Webhook delivery settings
+WEBHOOK_TIMEOUT = 5  # seconds
+WEBHOOK_MAX_WORKERS = int(os.environ.get('WEBHOOK_MAX_WORKERS', 8))
+
+WEBHOOK_DISPATCH_WORKERS = int(os.environ.get('WEBHOOK_DISPATCH_WORKERS', 4))
+
+# Shared pool so deliveries for one event go out concurrently
+_webhook_executor = ThreadPoolExecutor(max_workers=WEBHOOK_MAX_WORKERS, thread_name_prefix='webhook')
+# Separate bounded pool for the per-event lookup and fan-out; dispatches wait on
+# delivery futures, so sharing one pool could starve the deliveries
+_webhook_dispatch_executor = ThreadPoolExecutor(
+    max_workers=WEBHOOK_DISPATCH_WORKERS, thread_name_prefix='webhook-dispatch'
+)
+
+# Persistent session so repeat deliveries to a host reuse its TCP/TLS connection
+_webhook_session = requests.Session()
+_webhook_adapter = HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=max(WEBHOOK_MAX_WORKERS, 16),
+    max_retries=Retry(total=2, backoff_factor=0.1)
+)
+_webhook_session.mount('http://', _webhook_adapter)
+_webhook_session.mount('https://', _webhook_adapter)
+
+# OAuth lookup caches (process-local, bounded, short TTL)
+OAUTH_CACHE_TTL = 60  # seconds
+OAUTH_CACHE_MAXSIZE = 10_000
+_client_cache = TTLCache(maxsize=OAUTH_CACHE_MAXSIZE, ttl=OAUTH_CACHE_TTL)  # client_id -> credentials
+_token_cache = TTLCache(maxsize=OAUTH_CACHE_MAXSIZE, ttl=OAUTH_CACHE_TTL)  # token hash -> grant
+# token id -> time its access token was rotated; cached grants older than this are stale
+_token_rotated_at = TTLCache(maxsize=OAUTH_CACHE_MAXSIZE, ttl=OAUTH_CACHE_TTL)
+_oauth_cache_lock = threading.Lock()
+
+def _hash_token(token):
+    """Hash a bearer token so the raw value never becomes a cache key"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _generate_token_pair():
+    """Generate an access and refresh token from a single CSPRNG draw"""
+    raw = secrets.token_bytes(96)
+    return (
+        base64.urlsafe_b64encode(raw[:48]).rstrip(b'=').decode(),
+        base64.urlsafe_b64encode(raw[48:]).rstrip(b'=').decode()
+    )
+
+def _secrets_match(expected, provided):
+    """Compare two secret strings in constant time"""
+    if not expected or not provided:
+        return False
+    return hmac.compare_digest(expected.encode(), provided.encode())
+
+def _get_client_credentials(client_id):
+    """
+    Get the cached credentials of an active API client, or None
+    No endpoint changes a client's secret, scopes or status, so entries only
+    expire with OAUTH_CACHE_TTL.
+    """
+    with _oauth_cache_lock:
+        credentials = _client_cache.get(client_id)
+    if credentials is not None:
+        return credentials
+    
+    client = ApiClient.query.filter_by(client_id=client_id, is_active=True).first()
+    if not client:
+        with _oauth_cache_lock:
+            _client_cache.pop(client_id, None)
+        return None
+    
+    credentials = {
+        "id": client.id,
+        "user_id": client.user_id,
+        "client_secret": client.client_secret,
+        "allowed_scopes": client.allowed_scopes
+    }
+    with _oauth_cache_lock:
+        _client_cache[client_id] = credentials
+    return credentials
+
+def _get_token_grant(access_token):
+    """Get the cached grant for a valid, unrevoked access token, or None"""
+    cache_key = _hash_token(access_token)
+    with _oauth_cache_lock:
+        grant = _token_cache.get(cache_key)
+        if grant is not None and _token_rotated_at.get(grant["id"], 0) < grant["cached_at"]:
+            return grant
+    
+    api_token = ApiToken.query.filter_by(access_token=access_token, is_revoked=False).first()
+    if not api_token:
+        with _oauth_cache_lock:
+            _token_cache.pop(cache_key, None)
+        return None
+    
+    grant = {
+        "id": api_token.id,
+        "user_id": api_token.user_id,
+        "scopes": api_token.scopes,
+        "expires_at": api_token.expires_at,
+        "cached_at": time.time()
+    }
+    with _oauth_cache_lock:
+        _token_cache[cache_key] = grant
+    return grant
+
+def invalidate_token_cache(token_id):
+    """
+    Force cached grants for a token to be rechecked after its access token is rotated
+    This is an in-memory check; other workers drop their entries within OAUTH_CACHE_TTL.
+    """
+    with _oauth_cache_lock:
+        _token_rotated_at[token_id] = time.time()
+
+# Keyset pagination for list endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Versions returned by get_project with ?include=versions
+MAX_PROJECT_VERSIONS = 50
+
+def _keyset_page(query, id_column):
+    """
+    Apply ?limit=&after= pagination to a query, newest first
+    Returns the page rows and whether more rows follow. Filtering on the id
+    keeps every page an index range scan, unlike OFFSET.
+    """
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = request.args.get('after', type=int)
+    
+    if after is not None:
+        query = query.filter(id_column < after)
+    
+    rows = query.order_by(id_column.desc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+def _load_owned(model, object_id, user_id):
+    """
+    Load a row by primary key if it belongs to the user, else None
+    Going through Session.get lets repeat loads in a request hit the identity map.
+    """
+    obj = db.session.get(model, object_id)
+    if obj is None or obj.user_id != user_id:
+        return None
+    return obj
+
+def _normalize_files(files):
+    """
+    Validate a project files payload and return it as canonical JSON, or None
+    Accepts a list of {"name", "content"} string pairs or that list already
+    encoded as JSON, so reads of Project.files never see a malformed manifest.
+    """
+    if isinstance(files, str):
+        try:
+            files = current_app.json.loads(files)
+        except ValueError:
+            return None
+    if not isinstance(files, list):
+        return None
+    for file in files:
+        if not (isinstance(file, dict)
+                and isinstance(file.get('name'), str)
+                and isinstance(file.get('content'), str)):
+            return None
+    return current_app.json.dumps([{"name": file['name'], "content": file['content']} for file in files])
+
+def _load_team_and_role(team_id, user_id, member_id=None):
+    """
+    Load a team and the user's role in it with one query
+    Returns (team, role) or, when member_id is given, (team, role, member) for
+    that member's TeamMember row. Missing rows come back as None.
+    """
+    # A role already checked in this request is memoized on g; the team itself
+    # then comes from the identity map
+    key = (team_id, user_id)
+    if member_id is None and key in g.role_cache:
+        return db.session.get(Team, team_id), g.role_cache[key]
+    
+    target = aliased(TeamMember)
+    stmt = select(Team, TeamMember.role).outerjoin(
+        TeamMember, and_(TeamMember.team_id == Team.id, TeamMember.user_id == user_id)
+    ).where(Team.id == team_id)
+    
+    if member_id is not None:
+        stmt = stmt.add_columns(target).outerjoin(
+            target, and_(target.team_id == Team.id, target.user_id == member_id)
+        )
+    
+    row = db.session.execute(stmt).first()
+    if row is None:
+        return (None, None, None) if member_id is not None else (None, None)
+    
+    g.role_cache[key] = row[1]
+    return tuple(row)
+
+# Team actions each role may perform, mirroring the checks in the team endpoints
+TEAM_ROLE_ACTIONS = {
+    'owner': frozenset({'canView', 'canEdit', 'canDelete', 'canInvite', 'canManageMembers',
+                        'canTransferOwnership', 'canAddProject', 'canRemoveProject'}),
+    'admin': frozenset({'canView', 'canEdit', 'canInvite', 'canManageMembers',
+                        'canAddProject', 'canRemoveProject'}),
+    'member': frozenset({'canView', 'canAddProject'}),
+    'viewer': frozenset({'canView', 'canAddProject'}),
+}
+TEAM_ACTIONS = frozenset().union(*TEAM_ROLE_ACTIONS.values())
+
+# Integration read caches (short TTL, cleared on writes); kept in Redis when
+# available so a write on one worker is seen by all of them
+INTEGRATION_CACHE_PREFIX = 'integrations:'
+INTEGRATION_LIST_CACHE_TTL = 30  # seconds
+INTEGRATION_CACHE_TTL = 60  # seconds
+
+def _get_integration_cache(cache_key):
+    """Get a cached (etag, result) pair, or None"""
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        cached = redis_client.get(cache_key)
+        return tuple(current_app.json.loads(cached)) if cached is not None else None
+    return get_cached(cache_key)
+
+def _set_integration_cache(cache_key, etag, result, ttl):
+    """Cache an (etag, result) pair for ttl seconds"""
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        redis_client.setex(cache_key, ttl, current_app.json.dumps([etag, result]))
+    else:
+        set_cached(cache_key, (etag, result), ttl)
+
+def invalidate_integration_cache(user_id, integration_id=None):
+    """Drop a user's cached integration list, and one integration's details, after a write"""
+    keys = [f"{INTEGRATION_CACHE_PREFIX}{user_id}:list"]
+    if integration_id is not None:
+        keys.append(f"{INTEGRATION_CACHE_PREFIX}{user_id}:{integration_id}")
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        redis_client.delete(*keys)
+    for key in keys:
+        clear_cache(key)
+
 # API Authentication decorators
 def require_api_key(f):
     """Decorator to require API key for route access"""
@@ -30,21 +398,18 @@ def require_api_key(f):
         if not api_key:
             return jsonify({"error": "API key is required"}), 401
         
-        # Verify API key
-        user = User.query.filter_by(api_key=api_key).first()
+        # Verify API key by its hash
+        user = User.query.filter_by(api_key_hash=User.hash_api_key(api_key)).first()
         if not user:
             return jsonify({"error": "Invalid API key"}), 401
         
-        # Check if user has exceeded API quota
-        if user.api_usage_count >= user.api_quota:
+        # Check quota and count this call
+        if not _record_api_usage(user):
             return jsonify({"error": "API quota exceeded"}), 429
         
-        # Increment API usage counter
-        user.api_usage_count += 1
-        db.session.commit()
-        
         # Store user in g for access in the route
         g.user = user
+        g.role_cache = {}  # (team_id, user_id) -> role, filled as team routes check access
         return f(*args, **kwargs)
     
     return decorated_function
@@ -61,17 +426,17 @@ def require_oauth_token(f):
         token = auth_header.split(' ')[1]
         
         # Verify token
-        api_token = ApiToken.query.filter_by(access_token=token, is_revoked=False).first()
-        if not api_token:
+        grant = _get_token_grant(token)
+        if not grant:
             return jsonify({"error": "Invalid or revoked token"}), 401
         
         # Check if token is expired
-        if api_token.is_expired:
+        if grant["expires_at"] and g.now > grant["expires_at"]:
             return jsonify({"error": "Token has expired"}), 401
         
-        # Store user and token in g for access in the route
-        g.user = User.query.get(api_token.user_id)
-        g.token = api_token
+        # Store user and token grant in g for access in the route
+        g.user = db.session.get(User, grant["user_id"])
+        g.token = grant
         return f(*args, **kwargs)
     
     return decorated_function
@@ -87,7 +452,7 @@ def authorize():
     state = request.args.get('state')  # Optional but recommended
     
     # Validate client and redirect URI
-    client = ApiClient.query.filter_by(client_id=client_id, is_active=True).first()
+    client = _get_client_credentials(client_id)
     if not client:
         return jsonify({"error": "Invalid client"}), 400
     
@@ -98,8 +463,14 @@ def authorize():
     
     # Generate authorization code
     code = secrets.token_urlsafe(32)
-    client.authorization_code = code
-    client.code_expires_at = datetime.utcnow() + timedelta(minutes=10)
+    db.session.execute(
+        update(ApiClient)
+        .where(ApiClient.id == client["id"])
+        .values(
+            authorization_code=_hash_token(code),  # Only the hash is stored
+            code_expires_at=g.now + timedelta(minutes=10)
+        )
+    )
     db.session.commit()
     
     # Redirect to client with code
@@ -113,14 +484,59 @@ def authorize():
         "code": code
     })
 
+# Required form fields per grant type, checked before touching the database
+TOKEN_GRANT_FIELDS = {
+    'authorization_code': ('client_id', 'client_secret', 'code'),
+    'refresh_token': ('client_id', 'client_secret', 'refresh_token'),
+}
+MAX_GRANT_PARAM_LENGTH = 512
+
+# Failed token requests per IP, counted in Redis
+OAUTH_FAIL_KEY_PREFIX = 'oauth_fail:'
+OAUTH_FAIL_LIMIT = 20
+OAUTH_FAIL_WINDOW = 60  # seconds
+
+def _validate_grant_params(grant_type):
+    """Return an error message if the token request is malformed, else None"""
+    for field in TOKEN_GRANT_FIELDS[grant_type]:
+        value = request.form.get(field)
+        if not value:
+            return f"Missing required field: {field}"
+        if len(value) > MAX_GRANT_PARAM_LENGTH:
+            return f"Field too long: {field}"
+    return None
+
+def _too_many_grant_failures():
+    """Check whether the caller's IP has exceeded the failed token request limit"""
+    redis_client = get_redis_client()
+    if redis_client is None:
+        return False
+    failures = redis_client.get(f"{OAUTH_FAIL_KEY_PREFIX}{request.remote_addr}")
+    return int(failures or 0) >= OAUTH_FAIL_LIMIT
+
+def _reject_grant(message):
+    """Count a failed token request against the caller's IP and return a 401"""
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        key = f"{OAUTH_FAIL_KEY_PREFIX}{request.remote_addr}"
+        incr_window_counter(redis_client, key, OAUTH_FAIL_WINDOW)
+    return jsonify({"error": message}), 401
+
 @api.route('/oauth/token', methods=['POST'])
 def token():
     """OAuth 2.0 token endpoint"""
+    if _too_many_grant_failures():
+        return jsonify({"error": "Too many failed token requests"}), 429
+    
     # Validate grant type
     grant_type = request.form.get('grant_type')
-    if grant_type not in ['authorization_code', 'refresh_token']:
+    if grant_type not in TOKEN_GRANT_FIELDS:
         return jsonify({"error": "Unsupported grant type"}), 400
     
+    error = _validate_grant_params(grant_type)
+    if error:
+        return jsonify({"error": error}), 400
+    
     if grant_type == 'authorization_code':
         # Authorization code flow
         client_id = request.form.get('client_id')
@@ -128,41 +544,47 @@ def token():
         code = request.form.get('code')
         redirect_uri = request.form.get('redirect_uri')
         
-        # Validate client credentials
-        client = ApiClient.query.filter_by(
-            client_id=client_id, 
-            client_secret=client_secret,
-            is_active=True
-        ).first()
-        
-        if not client or client.authorization_code != code:
-            return jsonify({"error": "Invalid client credentials or code"}), 401
-        
-        # Check if code is expired
-        if not client.code_expires_at or client.code_expires_at < datetime.utcnow():
-            return jsonify({"error": "Authorization code has expired"}), 401
+        # Validate client credentials in constant time
+        client = _get_client_credentials(client_id)
+        if not client or not _secrets_match(client["client_secret"], client_secret):
+            return _reject_grant("Invalid client credentials or code")
         
         # Generate tokens
-        access_token = secrets.token_urlsafe(64)
-        refresh_token = secrets.token_urlsafe(64)
+        access_token, refresh_token = _generate_token_pair()
         expires_in = 3600  # 1 hour
+        now = g.now
         
-        # Create token record
-        api_token = ApiToken(
-            user_id=client.user_id,
-            api_client_id=client.id,
-            access_token=access_token,
-            refresh_token=refresh_token,
-            scopes=client.allowed_scopes,
-            expires_at=datetime.utcnow() + timedelta(seconds=expires_in)
-        )
+        scopes = client["allowed_scopes"]
         
-        # Clear authorization code
-        client.authorization_code = None
-        client.code_expires_at = None
-        client.last_used_at = datetime.utcnow()
+        # Consume the authorization code if it matches and has not expired;
+        # matching on its hash keeps the code single-use
+        consumed = db.session.execute(
+            update(ApiClient)
+            .where(
+                ApiClient.id == client["id"],
+                ApiClient.authorization_code == _hash_token(code),
+                ApiClient.code_expires_at >= now
+            )
+            .values(authorization_code=None, code_expires_at=None, last_used_at=now)
+        )
+        if consumed.rowcount != 1:
+            db.session.rollback()
+            return _reject_grant("Invalid or expired authorization code")
         
-        db.session.add(api_token)
+        # Create token record in the same transaction
+        db.session.execute(
+            insert(ApiToken).values(
+                user_id=client["user_id"],
+                api_client_id=client["id"],
+                access_token=access_token,
+                refresh_token=_hash_token(refresh_token),  # Only the hash is stored
+                token_type='Bearer',
+                scopes=scopes,
+                expires_at=now + timedelta(seconds=expires_in),
+                created_at=now,
+                is_revoked=False
+            )
+        )
         db.session.commit()
         
         return jsonify({
@@ -170,7 +592,7 @@ def token():
             "token_type": "Bearer",
             "expires_in": expires_in,
             "refresh_token": refresh_token,
-            "scope": client.allowed_scopes
+            "scope": scopes
         })
     
     elif grant_type == 'refresh_token':
@@ -180,38 +602,44 @@ def token():
         refresh_token = request.form.get('refresh_token')
         
         # Validate client credentials
-        client = ApiClient.query.filter_by(
-            client_id=client_id, 
-            client_secret=client_secret,
-            is_active=True
-        ).first()
-        
-        if not client:
-            return jsonify({"error": "Invalid client credentials"}), 401
-        
-        # Find token
-        token = ApiToken.query.filter_by(
-            refresh_token=refresh_token,
-            api_client_id=client.id,
-            is_revoked=False
-        ).first()
-        
-        if not token:
-            return jsonify({"error": "Invalid refresh token"}), 401
+        client = _get_client_credentials(client_id)
+        if not client or not _secrets_match(client["client_secret"], client_secret):
+            return _reject_grant("Invalid client credentials")
         
         # Generate new access token
         new_access_token = secrets.token_urlsafe(64)
         expires_in = 3600  # 1 hour
+        now = g.now
+        
+        # Rotate the access token of the token matching the presented refresh
+        # token's hash; RETURNING saves a separate SELECT
+        token = db.session.execute(
+            update(ApiToken)
+            .where(
+                ApiToken.refresh_token == _hash_token(refresh_token),
+                ApiToken.api_client_id == client["id"],
+                ApiToken.is_revoked == False
+            )
+            .values(access_token=new_access_token, expires_at=now + timedelta(seconds=expires_in))
+            .returning(ApiToken.id, ApiToken.scopes)
+        ).first()
         
-        # Update token
-        token.access_token = new_access_token
-        token.expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
+        if not token:
+            db.session.rollback()
+            return _reject_grant("Invalid refresh token")
         
         # Update client last used timestamp
-        client.last_used_at = datetime.utcnow()
+        db.session.execute(
+            update(ApiClient)
+            .where(ApiClient.id == client["id"])
+            .values(last_used_at=now)
+        )
         
         db.session.commit()
         
+        # The previous access token must stop validating from the cache
+        invalidate_token_cache(token.id)
+        
         return jsonify({
             "access_token": new_access_token,
             "token_type": "Bearer",
@@ -228,12 +656,12 @@ def generate_api_key():
     user = g.user
     force = request.json.get('force', False)
     
-    if user.api_key and not force:
+    if user.has_api_key and not force:
         return jsonify({"error": "API key already exists. Use force=true to regenerate."}), 400
     
     # Generate API key
     api_key = uuid.uuid4().hex
-    user.api_key = api_key
+    user.set_api_key(api_key)
     db.session.commit()
     
     return jsonify({
@@ -246,13 +674,14 @@ def generate_api_key():
 def get_api_key_info():
     """Get information about the current API key"""
     user = g.user
+    usage = (user.api_usage_count or 0) + _pending_api_usage(user)
     
     return jsonify({
         "user_id": user.id,
         "username": user.username,
         "quota": user.api_quota,
-        "usage": user.api_usage_count,
-        "remaining": max(0, user.api_quota - user.api_usage_count)
+        "usage": usage,
+        "remaining": max(0, user.api_quota - usage)
     })
 
 # Webhook management
@@ -261,7 +690,7 @@ def get_api_key_info():
 def list_webhooks():
     """List all webhooks for the current user"""
     user = g.user
-    webhooks = Webhook.query.filter_by(user_id=user.id).all()
+    webhooks, has_more = _keyset_page(Webhook.query.filter_by(user_id=user.id), Webhook.id)
     
     result = []
     for webhook in webhooks:
@@ -269,14 +698,17 @@ def list_webhooks():
             "id": webhook.id,
             "name": webhook.name,
             "url": webhook.url,
-            "events": json.loads(webhook.events),
+            "events": webhook.events or [],
             "is_active": webhook.is_active,
-            "created_at": webhook.created_at.isoformat() if webhook.created_at else None,
-            "last_triggered_at": webhook.last_triggered_at.isoformat() if webhook.last_triggered_at else None,
+            "created_at": webhook.created_at,
+            "last_triggered_at": webhook.last_triggered_at,
             "failure_count": webhook.failure_count
         })
     
-    return jsonify({"webhooks": result})
+    return jsonify({
+        "webhooks": result,
+        "next_cursor": result[-1]["id"] if has_more else None
+    })
 
 @api.route('/webhooks', methods=['POST'])
 @require_api_key
@@ -301,9 +733,9 @@ def create_webhook():
         user_id=user.id,
         name=data['name'],
         url=data['url'],
-        events=json.dumps(events),
+        events=events,
         description=data.get('description', ''),
-        secret=data.get('secret', secrets.token_hex(32)),
+        secret=data['secret'] if 'secret' in data else secrets.token_hex(32),
         is_active=data.get('is_active', True)
     )
     
@@ -325,26 +757,20 @@ def create_webhook():
 def get_webhook(webhook_id):
     """Get webhook details"""
     user = g.user
-    webhook = Webhook.query.filter_by(id=webhook_id, user_id=user.id).first()
+    webhook = _load_owned(Webhook, webhook_id, user.id)
     
     if not webhook:
         return jsonify({"error": "Webhook not found"}), 404
     
-    events = []
-    try:
-        events = json.loads(webhook.events)
-    except:
-        pass
-    
     return jsonify({
         "id": webhook.id,
         "name": webhook.name,
         "url": webhook.url,
-        "events": events,
+        "events": webhook.events or [],
         "description": webhook.description,
         "is_active": webhook.is_active,
-        "created_at": webhook.created_at.isoformat() if webhook.created_at else None,
-        "last_triggered_at": webhook.last_triggered_at.isoformat() if webhook.last_triggered_at else None,
+        "created_at": webhook.created_at,
+        "last_triggered_at": webhook.last_triggered_at,
         "failure_count": webhook.failure_count
     })
 
@@ -353,7 +779,7 @@ def get_webhook(webhook_id):
 def update_webhook(webhook_id):
     """Update webhook details"""
     user = g.user
-    webhook = Webhook.query.filter_by(id=webhook_id, user_id=user.id).first()
+    webhook = _load_owned(Webhook, webhook_id, user.id)
     
     if not webhook:
         return jsonify({"error": "Webhook not found"}), 404
@@ -375,7 +801,7 @@ def update_webhook(webhook_id):
         events = data['events']
         if not isinstance(events, list):
             return jsonify({"error": "Events must be a list"}), 400
-        webhook.events = json.dumps(events)
+        webhook.events = events
     
     if 'is_active' in data:
         webhook.is_active = bool(data['is_active'])
@@ -395,7 +821,7 @@ def update_webhook(webhook_id):
 def delete_webhook(webhook_id):
     """Delete a webhook"""
     user = g.user
-    webhook = Webhook.query.filter_by(id=webhook_id, user_id=user.id).first()
+    webhook = _load_owned(Webhook, webhook_id, user.id)
     
     if not webhook:
         return jsonify({"error": "Webhook not found"}), 404
@@ -410,78 +836,149 @@ def delete_webhook(webhook_id):
 # Helper function to trigger webhooks
 def trigger_webhook(user_id, event_type, payload):
     """Trigger webhooks for a specific event type"""
-    webhooks = Webhook.query.filter_by(user_id=user_id, is_active=True).all()
-    
-    for webhook in webhooks:
-        try:
-            events = json.loads(webhook.events)
-            if event_type not in events:
-                continue
-            
-            # Create webhook event record
-            event = WebhookEvent(
+    # Encode the payload once; the same body is stored, signed and sent
+    body = current_app.json.dumps(payload)
+    app = current_app._get_current_object()
+    
+    # The lookup and fan-out run on the dispatch pool so the request only
+    # waits on its own commit
+    future = _webhook_dispatch_executor.submit(_dispatch_webhook, app, user_id, event_type, body)
+    future.add_done_callback(_log_dispatch_failure)
+
+def _log_dispatch_failure(future):
+    """Log a webhook dispatch that raised, since nothing else reads its future"""
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Error dispatching webhooks: {str(error)}")
+
+def _dispatch_webhook(app, user_id, event_type, body):
+    """Record pending events for subscribed webhooks and deliver them"""
+    with app.app_context():
+        webhooks = Webhook.query.filter(
+            Webhook.user_id == user_id,
+            Webhook.is_active,
+            Webhook.events.contains([event_type])
+        ).all()
+        if not webhooks:
+            return
+        
+        # Create all webhook event records in a single flush
+        events = [
+            WebhookEvent(
                 webhook_id=webhook.id,
                 event_type=event_type,
-                payload=json.dumps(payload),
+                payload=body,
                 status='pending'
             )
+            for webhook in webhooks
+        ]
+        db.session.add_all(events)
+        db.session.flush()
+        
+        # Capture what the dispatch needs before commit expires the objects
+        deliveries = [
+            (event.id, webhook.id, webhook.url, webhook.secret)
+            for event, webhook in zip(events, webhooks)
+        ]
+        db.session.commit()
+    
+    _deliver_webhook_events(app, deliveries, event_type, body)
+
+@lru_cache(maxsize=1024)
+def _webhook_hmac(secret):
+    """Keyed HMAC state for a webhook secret, copied for each message"""
+    return hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+def _sign_webhook(secret, message):
+    """Sign a webhook message without re-deriving the HMAC key"""
+    mac = _webhook_hmac(secret).copy()
+    mac.update(message)
+    return mac.hexdigest()
+
+def _send_webhook(url, secret, event_type, body, timestamp, signature_base):
+    """POST a single webhook delivery and return the response"""
+    headers = {
+        'Content-Type': 'application/json',
+        'X-HACF-Event': event_type,
+        'X-HACF-Timestamp': timestamp
+    }
+    
+    # Calculate signature if secret is provided
+    if secret:
+        headers['X-HACF-Signature'] = _sign_webhook(secret, signature_base)
+    
+    return _webhook_session.post(
+        url,
+        data=body,
+        headers=headers,
+        timeout=WEBHOOK_TIMEOUT
+    )
+
+def _deliver_webhook_events(app, deliveries, event_type, body):
+    """Send webhook deliveries concurrently and record their results"""
+    # Every delivery shares the same body and timestamp, so encode them once
+    body_bytes = body.encode()
+    timestamp = str(int(time.time()))
+    signature_base = timestamp.encode() + b'.' + body_bytes
+    
+    futures = {
+        _webhook_executor.submit(
+            _send_webhook, url, secret, event_type, body_bytes, timestamp, signature_base
+        ): (event_id, webhook_id)
+        for event_id, webhook_id, url, secret in deliveries
+    }
+    
+    event_results = []
+    failed_webhook_ids = set()
+    
+    for future in as_completed(futures):
+        event_id, webhook_id = futures[future]
+        try:
+            response = future.result()
             
-            db.session.add(event)
-            db.session.commit()
-            
-            # In a production app, this would be handled by a background worker
-            # For now, we'll trigger synchronously for demo purposes
-            import requests
-            
-            # Calculate signature if secret is provided
-            signature = None
-            timestamp = str(int(datetime.utcnow().timestamp()))
-            
-            if webhook.secret:
-                payload_string = json.dumps(payload)
-                signature_base = f"{timestamp}.{payload_string}"
-                signature = hmac.new(
-                    webhook.secret.encode(),
-                    signature_base.encode(),
-                    hashlib.sha256
-                ).hexdigest()
-            
-            # Send request
-            headers = {
-                'Content-Type': 'application/json',
-                'X-HACF-Event': event_type,
-                'X-HACF-Timestamp': timestamp
-            }
-            
-            if signature:
-                headers['X-HACF-Signature'] = signature
-            
-            response = requests.post(
-                webhook.url,
-                json=payload,
-                headers=headers,
-                timeout=5
-            )
-            
-            # Update event record
-            event.status = 'sent' if response.ok else 'failed'
-            event.response_code = response.status_code
-            event.response_body = response.text
-            event.processed_at = datetime.utcnow()
-            
-            # Update webhook stats
-            webhook.last_triggered_at = datetime.utcnow()
+            event_results.append({
+                "event_id": event_id,
+                "status": 'sent' if response.ok else 'failed',
+                "response_code": response.status_code,
+                "response_body": response.text,
+                "processed_at": datetime.utcnow()
+            })
             if not response.ok:
-                webhook.failure_count += 1
-            
-            db.session.commit()
+                failed_webhook_ids.add(webhook_id)
         
         except Exception as e:
-            logger.error(f"Error triggering webhook {webhook.id}: {str(e)}")
-            
-            # Update webhook failure stats
-            webhook.failure_count += 1
-            db.session.commit()
+            logger.error(f"Error triggering webhook {webhook_id}: {str(e)}")
+            failed_webhook_ids.add(webhook_id)
+    
+    with app.app_context():
+        # Save delivery results and webhook stats in one commit
+        if event_results:
+            webhook_events = WebhookEvent.__table__
+            db.session.execute(
+                update(webhook_events)
+                .where(webhook_events.c.id == bindparam('event_id'))
+                .values(
+                    status=bindparam('status'),
+                    response_code=bindparam('response_code'),
+                    response_body=bindparam('response_body'),
+                    processed_at=bindparam('processed_at')
+                ),
+                event_results
+            )
+        
+        webhook_ids = [webhook_id for _, webhook_id, _, _ in deliveries]
+        db.session.execute(
+            update(Webhook)
+            .where(Webhook.id.in_(webhook_ids))
+            .values(
+                last_triggered_at=datetime.utcnow(),
+                failure_count=Webhook.failure_count + case(
+                    (Webhook.id.in_(failed_webhook_ids), 1),
+                    else_=0
+                )
+            )
+        )
+        db.session.commit()
 
 # Project API endpoints
 @api.route('/projects', methods=['GET'])
@@ -489,7 +986,20 @@ def trigger_webhook(user_id, event_type, payload):
 def list_projects():
     """List all projects for the current user"""
     user = g.user
-    projects = Project.query.filter_by(user_id=user.id).all()
+    
+    # Select only the summary columns; the layer output columns can be large
+    projects, has_more = _keyset_page(
+        db.session.query(
+            Project.id,
+            Project.title,
+            Project.description,
+            Project.progress.label('progress'),
+            Project.created_at,
+            Project.updated_at,
+            Project.completed_at
+        ).filter(Project.user_id == user.id),
+        Project.id
+    )
     
     result = []
     for project in projects:
@@ -497,35 +1007,58 @@ def list_projects():
             "id": project.id,
             "title": project.title,
             "description": project.description,
-            "progress": project.progress(),
-            "created_at": project.created_at.isoformat() if project.created_at else None,
-            "updated_at": project.updated_at.isoformat() if project.updated_at else None,
-            "completed_at": project.completed_at.isoformat() if project.completed_at else None
+            "progress": project.progress,
+            "created_at": project.created_at,
+            "updated_at": project.updated_at,
+            "completed_at": project.completed_at
         })
     
-    return jsonify({"projects": result})
+    return jsonify({
+        "projects": result,
+        "next_cursor": result[-1]["id"] if has_more else None
+    })
 
 @api.route('/projects/<int:project_id>', methods=['GET'])
 @require_api_key
 def get_project(project_id):
     """Get project details"""
     user = g.user
-    project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+    project = _load_owned(Project, project_id, user.id)
     
     if not project:
         return jsonify({"error": "Project not found"}), 404
     
-    # Get project versions
-    versions = ProjectVersion.query.filter_by(project_id=project.id).order_by(ProjectVersion.version_number.desc()).all()
-    version_list = []
-    
-    for version in versions:
-        version_list.append({
-            "version_number": version.version_number,
-            "description": version.description,
-            "created_at": version.created_at.isoformat() if version.created_at else None,
-            "created_by": version.created_by
-        })
+    # Version history is only loaded on request (?include=versions)
+    include_versions = 'versions' in request.args.get('include', '').split(',')
+    
+    # The project row changes whenever its content or versions do, so a cached
+    # copy can be validated without building the response
+    etag = _version_etag(project.id, project.updated_at, include_versions)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    
+    # Get the most recent project versions, without their snapshots
+    version_list = None
+    if include_versions:
+        versions = ProjectVersion.query.with_entities(
+            ProjectVersion.version_number,
+            ProjectVersion.description,
+            ProjectVersion.created_at,
+            ProjectVersion.created_by
+        ).filter_by(project_id=project.id).order_by(
+            ProjectVersion.version_number.desc()
+        ).limit(MAX_PROJECT_VERSIONS).all()
+        
+        version_list = [
+            {
+                "version_number": version.version_number,
+                "description": version.description,
+                "created_at": version.created_at,
+                "created_by": version.created_by
+            }
+            for version in versions
+        ]
     
     # Determine which layers are complete
     layers_complete = {
@@ -545,15 +1078,19 @@ def get_project(project_id):
         "development_code": project.development_code,
         "optimized_code": project.optimized_code,
         "files": project.files,
-        "progress": project.progress(),
+        "progress": project.progress,
         "layers_complete": layers_complete,
-        "versions": version_list,
-        "created_at": project.created_at.isoformat() if project.created_at else None,
-        "updated_at": project.updated_at.isoformat() if project.updated_at else None,
-        "completed_at": project.completed_at.isoformat() if project.completed_at else None
+        "created_at": project.created_at,
+        "updated_at": project.updated_at,
+        "completed_at": project.completed_at
     }
     
-    return jsonify(result)
+    if version_list is not None:
+        result["versions"] = version_list
+    
+    response = jsonify(result)
+    response.set_etag(etag)
+    return response
 
 @api.route('/projects', methods=['POST'])
 @require_api_key
@@ -582,7 +1119,7 @@ def create_project():
         "project_id": project.id,
         "title": project.title,
         "user_id": user.id,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": g.now_iso
     })
     
     return jsonify({
@@ -596,13 +1133,18 @@ def create_project():
 def update_project(project_id):
     """Update project details"""
     user = g.user
-    project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+    project = _load_owned(Project, project_id, user.id)
     
     if not project:
         return jsonify({"error": "Project not found"}), 404
     
     data = request.json
     
+    if 'files' in data:
+        files = _normalize_files(data['files'])
+        if files is None:
+            return jsonify({"error": "files must be a list of objects with string name and content"}), 400
+    
     # Update fields
     if 'title' in data:
         project.title = data['title']
@@ -623,7 +1165,7 @@ def update_project(project_id):
         project.optimized_code = data['optimized_code']
     
     if 'files' in data:
-        project.files = data['files']
+        project.files = files
     
     # Update layer completion flags
     if 'layer1_complete' in data:
@@ -641,10 +1183,7 @@ def update_project(project_id):
     if 'layer5_complete' in data:
         project.layer5_complete = bool(data['layer5_complete'])
     
-    # Check if project is completed
-    if project.layer5_complete and not project.completed_at:
-        project.completed_at = datetime.utcnow()
-    
+    # completed_at is stamped by the project_set_completed_at trigger
     db.session.commit()
     
     # Trigger webhook for project update
@@ -652,7 +1191,7 @@ def update_project(project_id):
         "project_id": project.id,
         "title": project.title,
         "user_id": user.id,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": g.now_iso
     })
     
     return jsonify({
@@ -665,7 +1204,7 @@ def update_project(project_id):
 def delete_project(project_id):
     """Delete a project"""
     user = g.user
-    project = Project.query.filter_by(id=project_id, user_id=user.id).first()
+    project = _load_owned(Project, project_id, user.id)
     
     if not project:
         return jsonify({"error": "Project not found"}), 404
@@ -677,7 +1216,7 @@ def delete_project(project_id):
     trigger_webhook(user.id, 'project.deleted', {
         "project_id": project_id,
         "user_id": user.id,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": g.now_iso
     })
     
     return jsonify({
@@ -692,10 +1231,10 @@ def list_templates():
     user = g.user
     
     # Get user's templates and public templates
-    templates = ProjectTemplate.query.filter(
+    templates, has_more = _keyset_page(ProjectTemplate.query.filter(
         (ProjectTemplate.user_id == user.id) | 
         (ProjectTemplate.is_public == True)
-    ).all()
+    ), ProjectTemplate.id)
     
     result = []
     for template in templates:
@@ -708,17 +1247,20 @@ def list_templates():
             "user_id": template.user_id,
             "is_owner": template.user_id == user.id,
             "use_count": template.use_count,
-            "created_at": template.created_at.isoformat() if template.created_at else None
+            "created_at": template.created_at
         })
     
-    return jsonify({"templates": result})
+    return jsonify({
+        "templates": result,
+        "next_cursor": result[-1]["id"] if has_more else None
+    })
 
 @api.route('/templates/<int:template_id>', methods=['GET'])
 @require_api_key
 def get_template(template_id):
     """Get template details"""
     user = g.user
-    template = ProjectTemplate.query.get(template_id)
+    template = db.session.get(ProjectTemplate, template_id)
     
     if not template:
         return jsonify({"error": "Template not found"}), 404
@@ -727,29 +1269,21 @@ def get_template(template_id):
     if not template.is_public and template.user_id != user.id:
         return jsonify({"error": "Access denied"}), 403
     
-    # Parse tags
-    tags = []
-    try:
-        if template.tags:
-            tags = json.loads(template.tags)
-    except:
-        pass
-    
     result = {
         "id": template.id,
         "name": template.name,
         "description": template.description,
         "configuration": template.configuration,
         "category": template.category,
-        "tags": tags,
+        "tags": template.tags or [],
         "is_public": template.is_public,
         "user_id": template.user_id,
         "is_owner": template.user_id == user.id,
         "use_count": template.use_count,
         "rating": template.rating,
         "rating_count": template.rating_count,
-        "created_at": template.created_at.isoformat() if template.created_at else None,
-        "updated_at": template.updated_at.isoformat() if template.updated_at else None
+        "created_at": template.created_at,
+        "updated_at": template.updated_at
     }
     
     return jsonify(result)
@@ -767,9 +1301,7 @@ def create_template():
     
     # Handle tags
     tags = data.get('tags', [])
-    if isinstance(tags, list):
-        tags_json = json.dumps(tags)
-    else:
+    if not isinstance(tags, list):
         return jsonify({"error": "Tags must be a list"}), 400
     
     # Create template
@@ -779,7 +1311,7 @@ def create_template():
         description=data.get('description', ''),
         configuration=data['configuration'],
         category=data.get('category', 'general'),
-        tags=tags_json,
+        tags=tags,
         is_public=data.get('is_public', False)
     )
     
@@ -797,7 +1329,7 @@ def create_template():
 def update_template(template_id):
     """Update template details"""
     user = g.user
-    template = ProjectTemplate.query.get(template_id)
+    template = db.session.get(ProjectTemplate, template_id)
     
     if not template:
         return jsonify({"error": "Template not found"}), 404
@@ -828,7 +1360,7 @@ def update_template(template_id):
     if 'tags' in data:
         tags = data['tags']
         if isinstance(tags, list):
-            template.tags = json.dumps(tags)
+            template.tags = tags
         else:
             return jsonify({"error": "Tags must be a list"}), 400
     
@@ -844,7 +1376,7 @@ def update_template(template_id):
 def delete_template(template_id):
     """Delete a template"""
     user = g.user
-    template = ProjectTemplate.query.get(template_id)
+    template = db.session.get(ProjectTemplate, template_id)
     
     if not template:
         return jsonify({"error": "Template not found"}), 404
@@ -867,17 +1399,13 @@ def list_teams():
     """List all teams for the current user"""
     user = g.user
     
-    # Get teams where user is a member
-    team_memberships = TeamMember.query.filter_by(user_id=user.id).all()
-    team_ids = [tm.team_id for tm in team_memberships]
-    teams = Team.query.filter(Team.id.in_(team_ids)).all()
+    # Get teams where user is a member, along with the user's role in each
+    rows, has_more = _keyset_page(db.session.query(Team, TeamMember.role).join(
+        TeamMember, TeamMember.team_id == Team.id
+    ).filter(TeamMember.user_id == user.id), Team.id)
     
     result = []
-    for team in teams:
-        # Get user's role in this team
-        team_member = TeamMember.query.filter_by(team_id=team.id, user_id=user.id).first()
-        role = team_member.role if team_member else None
-        
+    for team, role in rows:
         result.append({
             "id": team.id,
             "name": team.name,
@@ -885,10 +1413,13 @@ def list_teams():
             "owner_id": team.owner_id,
             "is_owner": team.owner_id == user.id,
             "role": role,
-            "created_at": team.created_at.isoformat() if team.created_at else None
+            "created_at": team.created_at
         })
     
-    return jsonify({"teams": result})
+    return jsonify({
+        "teams": result,
+        "next_cursor": result[-1]["id"] if has_more else None
+    })
 
 @api.route('/teams/<int:team_id>', methods=['GET'])
 @require_api_key
@@ -897,44 +1428,46 @@ def get_team(team_id):
     user = g.user
     
     # Check if user is a member of the team
-    team_member = TeamMember.query.filter_by(team_id=team_id, user_id=user.id).first()
-    if not team_member:
+    team, role = _load_team_and_role(team_id, user.id)
+    if not team or not role:
         return jsonify({"error": "Access denied"}), 403
     
-    team = Team.query.get(team_id)
-    if not team:
-        return jsonify({"error": "Team not found"}), 404
-    
-    # Get team members
-    members = TeamMember.query.filter_by(team_id=team.id).all()
-    member_list = []
-    
-    for member in members:
-        member_user = User.query.get(member.user_id)
-        if member_user:
-            member_list.append({
-                "user_id": member.user_id,
-                "username": member_user.username,
-                "email": member_user.email,
-                "role": member.role,
-                "joined_at": member.joined_at.isoformat() if member.joined_at else None
-            })
-    
-    # Get team projects
-    team_projects = TeamProject.query.filter_by(team_id=team.id).all()
-    project_list = []
-    
-    for tp in team_projects:
-        project = Project.query.get(tp.project_id)
-        if project:
-            project_list.append({
-                "id": project.id,
-                "title": project.title,
-                "description": project.description,
-                "progress": project.progress(),
-                "user_id": project.user_id,
-                "created_at": project.created_at.isoformat() if project.created_at else None
-            })
+    # Members joined to their users, selecting only the fields returned
+    members = db.session.execute(
+        select(
+            TeamMember.user_id, TeamMember.role, TeamMember.joined_at,
+            User.username, User.email
+        ).join(User, TeamMember.user_id == User.id).where(TeamMember.team_id == team_id)
+    ).all()
+    member_list = [
+        {
+            "user_id": member.user_id,
+            "username": member.username,
+            "email": member.email,
+            "role": member.role,
+            "joined_at": member.joined_at
+        }
+        for member in members
+    ]
+    
+    # Same for the team's projects
+    projects = db.session.execute(
+        select(
+            Project.id, Project.title, Project.description, Project.progress,
+            Project.user_id, Project.created_at
+        ).join(TeamProject, TeamProject.project_id == Project.id).where(TeamProject.team_id == team_id)
+    ).all()
+    project_list = [
+        {
+            "id": project.id,
+            "title": project.title,
+            "description": project.description,
+            "progress": project.progress,
+            "user_id": project.user_id,
+            "created_at": project.created_at
+        }
+        for project in projects
+    ]
     
     result = {
         "id": team.id,
@@ -943,15 +1476,43 @@ def get_team(team_id):
         "owner_id": team.owner_id,
         "avatar": team.avatar,
         "is_owner": team.owner_id == user.id,
-        "role": team_member.role,
+        "role": role,
         "members": member_list,
         "projects": project_list,
-        "created_at": team.created_at.isoformat() if team.created_at else None,
-        "updated_at": team.updated_at.isoformat() if team.updated_at else None
+        "created_at": team.created_at,
+        "updated_at": team.updated_at
     }
     
     return jsonify(result)
 
+@api.route('/teams/<int:team_id>/permissions/check', methods=['POST'])
+@require_api_key
+def check_team_permissions(team_id):
+    """Report which team actions the current user may perform, in one call"""
+    user = g.user
+    team, role = _load_team_and_role(team_id, user.id)
+    
+    if not team:
+        return jsonify({"error": "Team not found"}), 404
+    
+    if not role:
+        return jsonify({"error": "Access denied"}), 403
+    
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    
+    actions = data.get('actions') or sorted(TEAM_ACTIONS)
+    if not isinstance(actions, list) or not all(isinstance(action, str) for action in actions):
+        return jsonify({"error": "actions must be a list of strings"}), 400
+    
+    unknown = [action for action in actions if action not in TEAM_ACTIONS]
+    if unknown:
+        return jsonify({"error": f"Unknown actions: {', '.join(unknown)}"}), 400
+    
+    allowed = TEAM_ROLE_ACTIONS.get(role, frozenset())
+    return jsonify({action: action in allowed for action in actions})
+
 @api.route('/teams', methods=['POST'])
 @require_api_key
 def create_team():
@@ -963,30 +1524,28 @@ def create_team():
     if not data.get('name'):
         return jsonify({"error": "Team name is required"}), 400
     
-    # Create team
-    team = Team(
-        name=data['name'],
-        description=data.get('description', ''),
-        owner_id=user.id,
-        avatar=data.get('avatar')
-    )
-    
-    db.session.add(team)
-    db.session.flush()  # Get team ID without committing
+    # Create team, taking its ID from RETURNING rather than a flush
+    team_id = db.session.execute(
+        insert(Team)
+        .values(
+            name=data['name'],
+            description=data.get('description', ''),
+            owner_id=user.id,
+            avatar=data.get('avatar')
+        )
+        .returning(Team.id)
+    ).scalar()
     
     # Add creator as owner
-    team_member = TeamMember(
-        team_id=team.id,
-        user_id=user.id,
-        role='owner'
+    db.session.execute(
+        insert(TeamMember)
+        .values(team_id=team_id, user_id=user.id, role='owner', joined_at=g.now)
     )
-    
-    db.session.add(team_member)
     db.session.commit()
     
     return jsonify({
-        "id": team.id,
-        "name": team.name,
+        "id": team_id,
+        "name": data['name'],
         "message": "Team created successfully"
     }), 201
 
@@ -995,14 +1554,13 @@ def create_team():
 def update_team(team_id):
     """Update team details"""
     user = g.user
-    team = Team.query.get(team_id)
+    team, role = _load_team_and_role(team_id, user.id)
     
     if not team:
         return jsonify({"error": "Team not found"}), 404
     
     # Check permissions (owner or admin)
-    team_member = TeamMember.query.filter_by(team_id=team.id, user_id=user.id).first()
-    if not team_member or team_member.role not in ['owner', 'admin']:
+    if role not in ['owner', 'admin']:
         return jsonify({"error": "Access denied"}), 403
     
     data = request.json
@@ -1029,7 +1587,7 @@ def update_team(team_id):
 def delete_team(team_id):
     """Delete a team (owner only)"""
     user = g.user
-    team = Team.query.get(team_id)
+    team = db.session.get(Team, team_id)
     
     if not team:
         return jsonify({"error": "Team not found"}), 404
@@ -1050,14 +1608,13 @@ def delete_team(team_id):
 def add_team_member(team_id):
     """Add a member to the team"""
     user = g.user
-    team = Team.query.get(team_id)
+    team, role = _load_team_and_role(team_id, user.id)
     
     if not team:
         return jsonify({"error": "Team not found"}), 404
     
     # Check permissions (owner or admin)
-    team_member = TeamMember.query.filter_by(team_id=team.id, user_id=user.id).first()
-    if not team_member or team_member.role not in ['owner', 'admin']:
+    if role not in ['owner', 'admin']:
         return jsonify({"error": "Access denied"}), 403
     
     data = request.json
@@ -1066,49 +1623,153 @@ def add_team_member(team_id):
     if not data.get('user_id') and not data.get('email'):
         return jsonify({"error": "User ID or email is required"}), 400
     
+    member_role = data.get('role', 'member')
+    if not isinstance(member_role, str) or member_role not in ASSIGNABLE_TEAM_ROLES:
+        return jsonify({"error": f"Invalid role: {member_role}"}), 400
+    
     # Find user
     new_member = None
     if data.get('user_id'):
-        new_member = User.query.get(data['user_id'])
+        new_member = db.session.get(User, data['user_id'])
     elif data.get('email'):
         new_member = User.query.filter_by(email=data['email']).first()
     
     if not new_member:
         return jsonify({"error": "User not found"}), 404
     
-    # Check if user is already a member
-    existing_membership = TeamMember.query.filter_by(
-        team_id=team.id,
-        user_id=new_member.id
-    ).first()
+    new_member_id = new_member.id
+    new_member_name = new_member.username
     
-    if existing_membership:
-        return jsonify({"error": "User is already a member of this team"}), 400
+    # Add member unless already present; the unique constraint settles races
+    inserted = db.session.execute(
+        pg_insert(TeamMember)
+        .values(team_id=team_id, user_id=new_member_id, role=member_role, joined_at=g.now)
+        .on_conflict_do_nothing(index_elements=['team_id', 'user_id'])
+        .returning(TeamMember.id)
+    ).scalar()
     
-    # Add member
-    member = TeamMember(
-        team_id=team.id,
-        user_id=new_member.id,
-        role=data.get('role', 'member')
-    )
+    if inserted is None:
+        db.session.rollback()
+        return jsonify({"error": "User is already a member of this team"}), 400
     
-    db.session.add(member)
     db.session.commit()
     
     # Trigger webhook for member added
     trigger_webhook(user.id, 'team.member.added', {
-        "team_id": team.id,
-        "user_id": new_member.id,
+        "team_id": team_id,
+        "user_id": new_member_id,
         "added_by": user.id,
-        "role": member.role,
-        "timestamp": datetime.utcnow().isoformat()
+        "role": member_role,
+        "timestamp": g.now_iso
     })
     
     return jsonify({
-        "team_id": team.id,
-        "user_id": new_member.id,
-        "role": member.role,
-        "message": f"Added {new_member.username} to the team"
+        "team_id": team_id,
+        "user_id": new_member_id,
+        "role": member_role,
+        "message": f"Added {new_member_name} to the team"
+    })
+
+@api.route('/teams/<int:team_id>/members/bulk', methods=['POST'])
+@require_api_key
+def add_team_members_bulk(team_id):
+    """Add several members to the team in one transaction"""
+    user = g.user
+    team, role = _load_team_and_role(team_id, user.id)
+    
+    if not team:
+        return jsonify({"error": "Team not found"}), 404
+    
+    # Check permissions (owner or admin)
+    if role not in ['owner', 'admin']:
+        return jsonify({"error": "Access denied"}), 403
+    
+    members = (request.json or {}).get('members')
+    if not members or not isinstance(members, list):
+        return jsonify({"error": "A non-empty members list is required"}), 400
+    
+    # Validate required fields, normalising user IDs to ints
+    entries = []
+    for entry in members:
+        if not isinstance(entry, dict) or not (entry.get('user_id') or entry.get('email')):
+            return jsonify({"error": "Each member needs a user ID or email"}), 400
+        
+        member_role = entry.get('role', 'member')
+        if not isinstance(member_role, str) or member_role not in ASSIGNABLE_TEAM_ROLES:
+            return jsonify({"error": f"Invalid role: {member_role}"}), 400
+        
+        member_id = entry.get('user_id')
+        if member_id:
+            if isinstance(member_id, bool) or not isinstance(member_id, (int, str)):
+                return jsonify({"error": "User IDs must be positive integers"}), 400
+            try:
+                member_id = int(member_id)
+            except ValueError:
+                member_id = 0
+            if member_id < 1:
+                return jsonify({"error": "User IDs must be positive integers"}), 400
+        elif not isinstance(entry.get('email'), str):
+            return jsonify({"error": "Emails must be strings"}), 400
+        
+        entries.append((member_id, entry.get('email'), member_role))
+    
+    # Resolve every user in a single query
+    user_ids = {member_id for member_id, _, _ in entries if member_id}
+    emails = {email for member_id, email, _ in entries if not member_id}
+    found = db.session.execute(
+        select(User.id, User.email).where(
+            (User.id.in_(user_ids)) | (User.email.in_(emails))
+        )
+    ).all()
+    ids_by_email = {email: user_id for user_id, email in found}
+    known_ids = {user_id for user_id, _ in found}
+    
+    # Later entries for the same user override earlier ones
+    rows = {}
+    missing = []
+    for member_id, email, member_role in entries:
+        member_id = member_id or ids_by_email.get(email)
+        if member_id not in known_ids:
+            missing.append(member_id or email)
+            continue
+        rows[member_id] = {
+            "team_id": team_id,
+            "user_id": member_id,
+            "role": member_role,
+            "joined_at": g.now
+        }
+    
+    if missing:
+        return jsonify({"error": "Users not found", "missing": missing}), 404
+    
+    # Insert all rows in one statement; existing members are skipped
+    added_ids = set(db.session.execute(
+        pg_insert(TeamMember)
+        .values(list(rows.values()))
+        .on_conflict_do_nothing(index_elements=['team_id', 'user_id'])
+        .returning(TeamMember.user_id)
+    ).scalars())
+    db.session.commit()
+    
+    added = [
+        {"user_id": row["user_id"], "role": row["role"]}
+        for row in rows.values() if row["user_id"] in added_ids
+    ]
+    
+    # One webhook event covers the whole batch
+    if added:
+        trigger_webhook(user.id, 'team.members.added', {
+            "team_id": team_id,
+            "members": added,
+            "added_by": user.id,
+            "timestamp": g.now_iso
+        })
+    
+    return jsonify({
+        "team_id": team_id,
+        "added": added,
+        "already_members": [member_id for member_id in rows if member_id not in added_ids],
+        "message": f"Added {len(added)} members to the team"
     })
 
 @api.route('/teams/<int:team_id>/members/<int:member_id>', methods=['PUT'])
@@ -1116,18 +1777,16 @@ def add_team_member(team_id):
 def update_team_member(team_id, member_id):
     """Update a team member's role"""
     user = g.user
-    team = Team.query.get(team_id)
+    team, role, member = _load_team_and_role(team_id, user.id, member_id)
     
     if not team:
         return jsonify({"error": "Team not found"}), 404
     
     # Check permissions (owner or admin)
-    team_member = TeamMember.query.filter_by(team_id=team.id, user_id=user.id).first()
-    if not team_member or team_member.role not in ['owner', 'admin']:
+    if role not in ['owner', 'admin']:
         return jsonify({"error": "Access denied"}), 403
     
-    # Find member to update
-    member = TeamMember.query.filter_by(team_id=team.id, user_id=member_id).first()
+    # Check the member to update
     if not member:
         return jsonify({"error": "Member not found"}), 404
     
@@ -1144,38 +1803,43 @@ def update_team_member(team_id, member_id):
             return jsonify({"error": "Only the current owner can transfer ownership"}), 403
         
         old_role = member.role
-        member.role = data['role']
+        new_role = data['role']
         
-        # If making someone else owner, change current owner to admin
-        if data['role'] == 'owner' and member.user_id != user.id:
-            # Update team owner
-            team.owner_id = member.user_id
-            
-            # Change current owner to admin
-            current_owner = TeamMember.query.filter_by(
-                team_id=team.id,
-                user_id=user.id
-            ).first()
-            
-            if current_owner:
-                current_owner.role = 'admin'
+        if new_role == 'owner' and member.user_id != user.id:
+            # Transfer ownership: promote the member and demote the current
+            # owner to admin in one statement, then repoint the team
+            db.session.execute(
+                update(TeamMember)
+                .where(TeamMember.team_id == team_id, TeamMember.user_id.in_([user.id, member_id]))
+                .values(role=case({user.id: 'admin', member_id: 'owner'}, value=TeamMember.user_id))
+                .execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                update(Team)
+                .where(Team.id == team_id)
+                .values(owner_id=member_id, updated_at=g.now)
+                .execution_options(synchronize_session=False)
+            )
+            g.role_cache[(team_id, user.id)] = 'admin'
+        else:
+            member.role = new_role
         
         db.session.commit()
         
         # Trigger webhook for role changed
         trigger_webhook(user.id, 'team.member.updated', {
-            "team_id": team.id,
-            "user_id": member.user_id,
+            "team_id": team_id,
+            "user_id": member_id,
             "updated_by": user.id,
             "old_role": old_role,
-            "new_role": member.role,
-            "timestamp": datetime.utcnow().isoformat()
+            "new_role": new_role,
+            "timestamp": g.now_iso
         })
         
         return jsonify({
-            "team_id": team.id,
-            "user_id": member.user_id,
-            "role": member.role,
+            "team_id": team_id,
+            "user_id": member_id,
+            "role": new_role,
             "message": "Member role updated successfully"
         })
     
@@ -1186,18 +1850,16 @@ def update_team_member(team_id, member_id):
 def remove_team_member(team_id, member_id):
     """Remove a member from the team"""
     user = g.user
-    team = Team.query.get(team_id)
+    team, role, member = _load_team_and_role(team_id, user.id, member_id)
     
     if not team:
         return jsonify({"error": "Team not found"}), 404
     
     # Check permissions (owner or admin)
-    team_member = TeamMember.query.filter_by(team_id=team.id, user_id=user.id).first()
-    if not team_member or team_member.role not in ['owner', 'admin']:
+    if role not in ['owner', 'admin']:
         return jsonify({"error": "Access denied"}), 403
     
-    # Find member to remove
-    member = TeamMember.query.filter_by(team_id=team.id, user_id=member_id).first()
+    # Check the member to remove
     if not member:
         return jsonify({"error": "Member not found"}), 404
     
@@ -1214,7 +1876,7 @@ def remove_team_member(team_id, member_id):
         "team_id": team.id,
         "user_id": member_id,
         "removed_by": user.id,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": g.now_iso
     })
     
     return jsonify({
@@ -1226,14 +1888,13 @@ def remove_team_member(team_id, member_id):
 def add_project_to_team(team_id):
     """Add a project to the team"""
     user = g.user
-    team = Team.query.get(team_id)
+    team, role = _load_team_and_role(team_id, user.id)
     
     if not team:
         return jsonify({"error": "Team not found"}), 404
     
     # Check if user is a member of the team
-    team_member = TeamMember.query.filter_by(team_id=team.id, user_id=user.id).first()
-    if not team_member:
+    if not role:
         return jsonify({"error": "Access denied"}), 403
     
     data = request.json
@@ -1245,33 +1906,29 @@ def add_project_to_team(team_id):
     project_id = data['project_id']
     
     # Verify project exists and user owns it
-    project = Project.query.get(project_id)
+    project = db.session.get(Project, project_id)
     if not project:
         return jsonify({"error": "Project not found"}), 404
     
     if project.user_id != user.id:
         return jsonify({"error": "You do not own this project"}), 403
     
-    # Check if project is already in the team
-    existing_team_project = TeamProject.query.filter_by(
-        team_id=team.id,
-        project_id=project_id
-    ).first()
+    # Add project to team unless it is already part of it
+    inserted = db.session.execute(
+        pg_insert(TeamProject)
+        .values(team_id=team_id, project_id=project_id)
+        .on_conflict_do_nothing(index_elements=['team_id', 'project_id'])
+        .returning(TeamProject.id)
+    ).scalar()
     
-    if existing_team_project:
+    if inserted is None:
+        db.session.rollback()
         return jsonify({"error": "Project is already part of this team"}), 400
     
-    # Add project to team
-    team_project = TeamProject(
-        team_id=team.id,
-        project_id=project_id
-    )
-    
-    db.session.add(team_project)
     db.session.commit()
     
     return jsonify({
-        "team_id": team.id,
+        "team_id": team_id,
         "project_id": project_id,
         "message": "Project added to team successfully"
     })
@@ -1281,28 +1938,28 @@ def add_project_to_team(team_id):
 def remove_project_from_team(team_id, project_id):
     """Remove a project from the team"""
     user = g.user
-    team = Team.query.get(team_id)
+    team, role = _load_team_and_role(team_id, user.id)
     
     if not team:
         return jsonify({"error": "Team not found"}), 404
     
     # Check permissions (owner, admin, or project owner)
-    team_member = TeamMember.query.filter_by(team_id=team.id, user_id=user.id).first()
-    if not team_member:
+    if not role:
         return jsonify({"error": "Access denied"}), 403
     
-    # Find team project
-    team_project = TeamProject.query.filter_by(team_id=team.id, project_id=project_id).first()
-    if not team_project:
+    # Find team project along with the project's owner
+    row = db.session.execute(
+        select(TeamProject, Project.user_id)
+        .join(Project, Project.id == TeamProject.project_id)
+        .where(TeamProject.team_id == team_id, TeamProject.project_id == project_id)
+    ).first()
+    if not row:
         return jsonify({"error": "Project not found in this team"}), 404
     
-    # Check permissions for removing project
-    project = Project.query.get(project_id)
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
+    team_project, project_owner_id = row
     
     # Allow if user is team owner/admin or project owner
-    if team_member.role not in ['owner', 'admin'] and project.user_id != user.id:
+    if role not in ['owner', 'admin'] and project_owner_id != user.id:
         return jsonify({"error": "You do not have permission to remove this project"}), 403
     
     # Remove project from team
@@ -1319,20 +1976,49 @@ def remove_project_from_team(team_id, project_id):
 def list_integrations():
     """List all integrations for the current user"""
     user = g.user
-    integrations = Integration.query.filter_by(user_id=user.id).all()
-    
-    result = []
-    for integration in integrations:
-        result.append({
-            "id": integration.id,
-            "provider": integration.provider,
-            "name": integration.name,
-            "is_active": integration.is_active,
-            "created_at": integration.created_at.isoformat() if integration.created_at else None,
-            "last_used_at": integration.last_used_at.isoformat() if integration.last_used_at else None
-        })
+    cache_key = f"{INTEGRATION_CACHE_PREFIX}{user.id}:list"
+    
+    cached = _get_integration_cache(cache_key)
+    if cached is not None:
+        etag, result = cached
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+    else:
+        # Any create, update or delete changes the count or the latest timestamps
+        count, last_updated, last_used = db.session.execute(
+            select(
+                func.count(Integration.id),
+                func.max(Integration.updated_at),
+                func.max(Integration.last_used_at)
+            ).where(Integration.user_id == user.id)
+        ).one()
+        etag = _version_etag(user.id, count, last_updated, last_used)
+        not_modified = _not_modified(etag)
+        if not_modified:
+            return not_modified
+        
+        # Select only the listed columns and take each row as a plain dict;
+        # config and credentials never leave the database
+        result = [
+            dict(row)
+            for row in db.session.execute(
+                select(
+                    Integration.id,
+                    Integration.provider,
+                    Integration.name,
+                    Integration.is_active,
+                    Integration.created_at,
+                    Integration.last_used_at
+                ).where(Integration.user_id == user.id)
+            ).mappings()
+        ]
+        
+        _set_integration_cache(cache_key, etag, result, INTEGRATION_LIST_CACHE_TTL)
     
-    return jsonify({"integrations": result})
+    response = jsonify({"integrations": result})
+    response.set_etag(etag)
+    return response
 
 @api.route('/integrations', methods=['POST'])
 @require_api_key
@@ -1347,33 +2033,34 @@ def create_integration():
         if field not in data:
             return jsonify({"error": f"Missing required field: {field}"}), 400
     
-    # Check for duplicate
-    existing = Integration.query.filter_by(
-        user_id=user.id,
-        provider=data['provider'],
-        name=data['name']
-    ).first()
+    # Create integration unless one with this provider and name already exists
+    integration_id = db.session.execute(
+        pg_insert(Integration)
+        .values(
+            user_id=user.id,
+            provider=data['provider'],
+            name=data['name'],
+            config=data['config'],
+            credentials=SecurityManager.encrypt_secret(data['credentials'], f"integration:{user.id}") if data.get('credentials') else None,
+            is_active=data.get('is_active', True),
+            created_at=g.now,
+            updated_at=g.now
+        )
+        .on_conflict_do_nothing(index_elements=['user_id', 'provider', 'name'])
+        .returning(Integration.id)
+    ).scalar()
     
-    if existing:
+    if integration_id is None:
+        db.session.rollback()
         return jsonify({"error": "Integration with this provider and name already exists"}), 400
     
-    # Create integration
-    integration = Integration(
-        user_id=user.id,
-        provider=data['provider'],
-        name=data['name'],
-        config=json.dumps(data['config']),
-        credentials=json.dumps(data.get('credentials', {})) if data.get('credentials') else None,
-        is_active=data.get('is_active', True)
-    )
-    
-    db.session.add(integration)
     db.session.commit()
+    invalidate_integration_cache(user.id)
     
     return jsonify({
-        "id": integration.id,
-        "provider": integration.provider,
-        "name": integration.name,
+        "id": integration_id,
+        "provider": data['provider'],
+        "name": data['name'],
         "message": "Integration created successfully"
     }), 201
 
@@ -1382,36 +2069,44 @@ def create_integration():
 def get_integration(integration_id):
     """Get integration details"""
     user = g.user
-    integration = Integration.query.filter_by(id=integration_id, user_id=user.id).first()
+    cache_key = f"{INTEGRATION_CACHE_PREFIX}{user.id}:{integration_id}"
     
-    if not integration:
-        return jsonify({"error": "Integration not found"}), 404
-    
-    config = {}
-    try:
-        if integration.config:
-            config = json.loads(integration.config)
-    except:
-        pass
-    
-    result = {
-        "id": integration.id,
-        "provider": integration.provider,
-        "name": integration.name,
-        "config": config,
-        "is_active": integration.is_active,
-        "created_at": integration.created_at.isoformat() if integration.created_at else None,
-        "last_used_at": integration.last_used_at.isoformat() if integration.last_used_at else None
-    }
-    
-    return jsonify(result)
+    cached = _get_integration_cache(cache_key)
+    if cached is not None:
+        etag, result = cached
+    else:
+        integration = _load_owned(Integration, integration_id, user.id)
+        
+        if not integration:
+            return jsonify({"error": "Integration not found"}), 404
+        
+        etag = _version_etag(integration.id, integration.updated_at, integration.last_used_at)
+        
+        result = {
+            "id": integration.id,
+            "provider": integration.provider,
+            "name": integration.name,
+            "config": integration.config or {},
+            "is_active": integration.is_active,
+            "created_at": integration.created_at,
+            "last_used_at": integration.last_used_at
+        }
+        _set_integration_cache(cache_key, etag, result, INTEGRATION_CACHE_TTL)
+    
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    
+    response = jsonify(result)
+    response.set_etag(etag)
+    return response
 
 @api.route('/integrations/<int:integration_id>', methods=['PUT'])
 @require_api_key
 def update_integration(integration_id):
     """Update integration details"""
     user = g.user
-    integration = Integration.query.filter_by(id=integration_id, user_id=user.id).first()
+    integration = _load_owned(Integration, integration_id, user.id)
     
     if not integration:
         return jsonify({"error": "Integration not found"}), 404
@@ -1423,15 +2118,19 @@ def update_integration(integration_id):
         integration.name = data['name']
     
     if 'config' in data:
-        integration.config = json.dumps(data['config'])
+        integration.config = data['config']
     
     if 'credentials' in data:
-        integration.credentials = json.dumps(data['credentials'])
+        integration.credentials = (
+            SecurityManager.encrypt_secret(data['credentials'], f"integration:{user.id}")
+            if data['credentials'] else None
+        )
     
     if 'is_active' in data:
         integration.is_active = bool(data['is_active'])
     
     db.session.commit()
+    invalidate_integration_cache(user.id, integration_id)
     
     return jsonify({
         "id": integration.id,
@@ -1443,13 +2142,14 @@ def update_integration(integration_id):
 def delete_integration(integration_id):
     """Delete an integration"""
     user = g.user
-    integration = Integration.query.filter_by(id=integration_id, user_id=user.id).first()
+    integration = _load_owned(Integration, integration_id, user.id)
     
     if not integration:
         return jsonify({"error": "Integration not found"}), 404
     
     db.session.delete(integration)
     db.session.commit()
+    invalidate_integration_cache(user.id, integration_id)
     
     return jsonify({
         "message": "Integration deleted successfully"
@@ -1,19 +1,40 @@
 import os
 import logging
-import json
 import datetime
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file, flash
+import hashlib
+import time
+import uuid
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, abort, make_response, render_template, stream_template, request, jsonify, session, redirect, url_for, flash
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import DeclarativeBase, Session, joinedload, load_only, raiseload, selectinload
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from io import BytesIO
 import zipfile
 
+try:
+    from flask_session import Session as ServerSideSession
+except ImportError:
+    ServerSideSession = None
+
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+def utcnow():
+    """Current UTC time as a naive datetime, the way the DateTime columns store it"""
+    return datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
 class Base(DeclarativeBase):
     pass
 
@@ -22,14 +43,73 @@ db = SQLAlchemy(model_class=Base)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 
+# Key for integration credentials encrypted at rest. Required rather than derived
+# from SESSION_SECRET, whose default is public and whose rotation would leave
+# every stored credential undecryptable
+app.config["CREDENTIALS_ENCRYPTION_KEY"] = os.environ.get("CREDENTIALS_ENCRYPTION_KEY")
+if not app.config["CREDENTIALS_ENCRYPTION_KEY"]:
+    raise RuntimeError(
+        "CREDENTIALS_ENCRYPTION_KEY is not set; generate one with "
+        "python -c 'import base64, os; print(base64.urlsafe_b64encode(os.urandom(32)).decode())'"
+    )
+
+# Keep compiled templates on disk so new workers skip recompiling them. Without
+# an explicit app-owned directory Jinja picks a per-user 0700 temp directory and
+# checks its ownership, so other local users cannot plant bytecode there
+_jinja_cache_dir = os.environ.get("JINJA_BYTECODE_CACHE_DIR")
+app.jinja_env.bytecode_cache = (
+    FileSystemBytecodeCache(_jinja_cache_dir) if _jinja_cache_dir else FileSystemBytecodeCache()
+)
+
+# Use orjson for jsonify and request.json
+from performance import ORJSONProvider, get_redis_client, get_cached, set_cached, clear_cache
+app.json = ORJSONProvider(app)
+
+# Keep session data in Redis when Flask-Session is installed and REDIS_URL is
+# set; the cookie then only carries the session id
+if ServerSideSession is not None and get_redis_client() is not None:
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_PERMANENT"] = False
+    app.config["SESSION_REDIS"] = get_redis_client()
+    ServerSideSession(app)
+
+# Compress text and JSON responses for clients that accept it
+if Compress is not None:
+    app.config["COMPRESS_ALGORITHM"] = ["zstd", "br", "gzip"]
+    app.config["COMPRESS_MIN_SIZE"] = 1024
+    Compress(app)
+
 # Configure the PostgreSQL database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
+    # Enough connections for every gunicorn thread in the worker, with headroom;
+    # lower these when connecting through PgBouncer
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+    "pool_timeout": 10,
+    # Reuse the most recently returned connection so idle ones can be recycled
+    "pool_use_lifo": True,
+    # Encode and decode JSON/JSONB columns with orjson as well
+    "json_serializer": app.json.dumps,
+    "json_deserializer": app.json.loads,
 }
+if app.config["SQLALCHEMY_DATABASE_URI"] and app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgres"):
+    # Send executemany UPDATE/DELETE through psycopg2's execute_batch; INSERTs
+    # already go out as multi-row VALUES pages
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+        "executemany_mode": "values_plus_batch",
+        "insertmanyvalues_page_size": 1000,
+        "executemany_batch_page_size": 500,
+    })
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Make unplanned lazy loads raise instead of quietly querying (for tests/CI)
+app.config["SQLALCHEMY_RAISELOAD"] = os.environ.get("SQLALCHEMY_RAISELOAD") == "1"
+# Log statements slower than this many milliseconds (0 disables)
+app.config["SLOW_QUERY_THRESHOLD_MS"] = int(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 100))
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -39,21 +119,49 @@ login_manager.login_message = 'Please log in to access this page.'
 # Initialize SQLAlchemy
 db.init_app(app)
 
+if app.config["SQLALCHEMY_RAISELOAD"]:
+    @event.listens_for(Session, "do_orm_execute")
+    def _raise_on_lazy_load(orm_execute_state):
+        """Default every top-level ORM select to raiseload; explicit loader options still win"""
+        if (
+            orm_execute_state.is_select
+            and not orm_execute_state.is_column_load
+            and not orm_execute_state.is_relationship_load
+        ):
+            orm_execute_state.statement = orm_execute_state.statement.options(
+                raiseload('*', sql_only=True)
+            )
+
+if app.config["SLOW_QUERY_THRESHOLD_MS"]:
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+        if elapsed_ms >= app.config["SLOW_QUERY_THRESHOLD_MS"]:
+            logger.warning(f"Slow query ({elapsed_ms:.0f} ms): {statement}")
+
 # User loader function for Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
+    # Runs on every authenticated request; models is imported below at startup
+    return db.session.get(models.User, int(user_id))
 
 with app.app_context():
     # Make sure to import the models here
     import models
+    # Aliased so the advanced_hacf view below does not shadow the module
+    import advanced_hacf as hacf_engine
+    from security import SecurityManager, user_rate_limited
+    SecurityManager.verify_secret_encryption()
     db.create_all()
     
     # Create default admin user for testing purposes
     # Note: This is only for testing and should be changed in production
     default_admin_email = "admin@hacf.com"
-    if not models.User.query.filter_by(email=default_admin_email).first():
+    if not db.session.scalar(db.select(db.exists().where(models.User.email == default_admin_email))):
         logger.info("Creating default admin user for testing")
         admin_user = models.User(
             username="admin",
@@ -69,6 +177,9 @@ with app.app_context():
 def home():
     return render_template('index.html')
 
+# How stale User.last_login may get before a login writes it again
+LAST_LOGIN_RESOLUTION = datetime.timedelta(minutes=15)
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     # If already logged in, redirect to dashboard
@@ -83,12 +194,20 @@ def login():
             flash('Please fill out all fields.', 'danger')
             return render_template('login.html')
         
-        user = models.User.query.filter_by(email=email).first()
+        user = db.session.scalars(db.select(models.User).filter_by(email=email)).first()
         
         if user and user.check_password(password):
             login_user(user)
-            user.last_login = datetime.datetime.utcnow()
-            db.session.commit()
+            # last_login is only refreshed once it is LAST_LOGIN_RESOLUTION stale,
+            # so back-to-back logins skip the write entirely
+            now = utcnow()
+            if not user.last_login or now - user.last_login > LAST_LOGIN_RESOLUTION:
+                user.last_login = now
+            # Upgrade legacy or outdated hashes while the plaintext is at hand
+            if user.password_needs_rehash:
+                user.set_password(password)
+            if db.session.dirty:
+                db.session.commit()
             
             # Redirect to requested page or dashboard
             next_page = request.args.get('next')
@@ -119,11 +238,11 @@ def register():
             return render_template('register.html')
         
         # Check if email or username already exists
-        if models.User.query.filter_by(email=email).first():
+        if db.session.scalar(db.select(db.exists().where(models.User.email == email))):
             flash('Email already registered.', 'danger')
             return render_template('register.html')
         
-        if models.User.query.filter_by(username=username).first():
+        if db.session.scalar(db.select(db.exists().where(models.User.username == username))):
             flash('Username already taken.', 'danger')
             return render_template('register.html')
         
@@ -132,7 +251,7 @@ def register():
         user.set_password(password)
         
         # First user gets admin privileges
-        if models.User.query.count() == 0:
+        if not db.session.scalar(db.select(db.exists().select_from(models.User))):
             user.role = 'admin'
         
         db.session.add(user)
@@ -153,9 +272,34 @@ def logout():
 @app.route('/profile')
 @login_required
 def profile():
-    # Get teams the user is a member of
-    teams = models.TeamMember.query.filter_by(user_id=current_user.id).all()
-    return render_template('profile.html', teams=teams)
+    # Get teams the user is a member of, with each team's members for the counts
+    teams = db.session.scalars(
+        db.select(models.TeamMember)
+        .filter_by(user_id=current_user.id)
+        .options(joinedload(models.TeamMember.team).selectinload(models.Team.members))
+    ).all()
+    
+    # A newly generated API key is shown once; only its hash is stored
+    new_api_key = session.pop('new_api_key', None)
+    return render_template('profile.html', teams=teams, new_api_key=new_api_key)
+
+# Adaptive sequencing networks shown on the advanced HACF page
+ADVANCED_HACF_NETWORKS = {
+    'standard': 'Linear progression through layers',
+    'agile': 'Flexible layer sequence with iterative development',
+    'research': 'Research-oriented with multiple exploration paths',
+    'security_focused': 'Security-focused with enhanced validation',
+    'iterative_development': 'Rapid iteration on development and optimization'
+}
+
+# Template context for the advanced HACF page, which is static per process
+ADVANCED_HACF_CONTEXT = {
+    'domains': hacf_engine.DomainSpecializationEngine.get_available_domains(),
+    'networks': ADVANCED_HACF_NETWORKS,
+    'memory_types': hacf_engine.CrossLayerMemory.MEMORY_TYPES,
+    'evaluation_dimensions': hacf_engine.ProprietaryEvaluation.EVALUATION_DIMENSIONS,
+    'checkpoint_types': hacf_engine.HumanAICollaborationManager.CHECKPOINT_TYPES
+}
 
 @app.route('/advanced_hacf')
 @login_required
@@ -168,36 +312,7 @@ def advanced_hacf():
     - Domain Specialization
     - Human-AI Collaboration Checkpoints
     """
-    # Get available domains for the domain specialization section
-    import advanced_hacf
-    domains = advanced_hacf.DomainSpecializationEngine.get_available_domains()
-    
-    # Get available networks for the adaptive sequencing section
-    networks = {
-        'standard': 'Linear progression through layers',
-        'agile': 'Flexible layer sequence with iterative development',
-        'research': 'Research-oriented with multiple exploration paths',
-        'security_focused': 'Security-focused with enhanced validation',
-        'iterative_development': 'Rapid iteration on development and optimization'
-    }
-    
-    # Memory types for the cross-layer memory section
-    memory_types = advanced_hacf.CrossLayerMemory.MEMORY_TYPES
-    
-    # Evaluation dimensions for the proprietary evaluation section
-    evaluation_dimensions = advanced_hacf.ProprietaryEvaluation.EVALUATION_DIMENSIONS
-    
-    # Checkpoint types for the human-AI collaboration section
-    checkpoint_types = advanced_hacf.HumanAICollaborationManager.CHECKPOINT_TYPES
-    
-    return render_template(
-        'advanced_hacf.html',
-        domains=domains,
-        networks=networks,
-        memory_types=memory_types,
-        evaluation_dimensions=evaluation_dimensions,
-        checkpoint_types=checkpoint_types
-    )
+    return render_template('advanced_hacf.html', **ADVANCED_HACF_CONTEXT)
 
 @app.route('/dashboard')
 @login_required
@@ -205,10 +320,10 @@ def dashboard():
     # Fetch all projects for the current user
     if current_user.role == 'admin':
         # Admins can see all projects
-        projects = models.Project.query.all()
+        projects = db.session.scalars(db.select(models.Project)).all()
     else:
         # Regular users only see their own projects
-        projects = models.Project.query.filter_by(user_id=current_user.id).all()
+        projects = db.session.scalars(db.select(models.Project).filter_by(user_id=current_user.id)).all()
     return render_template('dashboard.html', projects=projects)
 
 @app.route('/documentation')
@@ -226,162 +341,164 @@ def documentation():
     """
     return render_template('documentation.html')
 
-@app.route('/analytics')
-@login_required
-def analytics():
-    # Restrict analytics to admins and managers
-    if current_user.role not in ['admin', 'manager']:
-        flash('You do not have permission to access analytics.', 'danger')
-        return redirect(url_for('dashboard'))
-    
-    # Get basic stats
-    projects = models.Project.query.all()
-    completed_projects = models.Project.query.filter_by(layer11_complete=True).count()
+# Analytics aggregates are shared by every viewer, so they are cached in Redis
+# (or the process cache without it) and dropped when projects change
+ANALYTICS_CACHE_KEY = 'analytics:stats'
+ANALYTICS_CACHE_TTL = 60  # seconds
+
+def _compute_analytics_stats():
+    """Get the site-wide project stats, computing them at most once per TTL"""
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        cached = redis_client.get(ANALYTICS_CACHE_KEY)
+        if cached is not None:
+            return app.json.loads(cached)
+    else:
+        cached = get_cached(ANALYTICS_CACHE_KEY)
+        if cached is not None:
+            return cached
+    
+    # Count projects, completed projects and messages in one aggregate query
+    total_projects, completed_projects, total_interactions = db.session.execute(
+        select(
+            func.count(models.Project.id),
+            func.count(models.Project.id).filter(models.Project.layer11_complete),
+            select(func.count(models.Message.id)).scalar_subquery()
+        )
+    ).one()
     
     stats = {
-        'total_projects': len(projects),
-        'active_projects': len(projects) - completed_projects,
+        'total_projects': total_projects,
+        'active_projects': total_projects - completed_projects,
         'completed_projects': completed_projects,
-        'completion_rate': int((completed_projects / len(projects)) * 100) if projects else 0,
+        'completion_rate': int((completed_projects / total_projects) * 100) if total_projects else 0,
         'files_generated': 0,  # Would calculate from actual files
         'avg_files_per_project': 0,  # Would calculate from actual files
-        'total_interactions': models.Message.query.count()
+        'total_interactions': total_interactions
     }
     
-    # Layer statistics for all 12 layers
-    layer_stats = {
-        'layer0': {'avg_time': 1, 'success_rate': 97, 'common_issue': 'Unclear requirements'},
-        'layer1': {'avg_time': 2, 'success_rate': 95, 'common_issue': 'Incomplete specifications'},
-        'layer2': {'avg_time': 3, 'success_rate': 90, 'common_issue': 'Research gaps'},
-        'layer3': {'avg_time': 4, 'success_rate': 88, 'common_issue': 'Incompatible technologies'},
-        'layer4': {'avg_time': 5, 'success_rate': 85, 'common_issue': 'Prototype limitations'},
-        'layer5': {'avg_time': 10, 'success_rate': 75, 'common_issue': 'Integration errors'},
-        'layer6': {'avg_time': 4, 'success_rate': 82, 'common_issue': 'Test coverage gaps'},
-        'layer7': {'avg_time': 6, 'success_rate': 80, 'common_issue': 'Security vulnerabilities'},
-        'layer8': {'avg_time': 3, 'success_rate': 92, 'common_issue': 'Configuration issues'},
-        'layer9': {'avg_time': 1, 'success_rate': 98, 'common_issue': 'File formatting issues'},
-        'layer10': {'avg_time': 2, 'success_rate': 94, 'common_issue': 'Monitoring setup problems'},
-        'layer11': {'avg_time': 3, 'success_rate': 91, 'common_issue': 'Maintenance planning gaps'}
-    }
-    
-    # Project timeline data
-    timeline_data = {
-        'dates': json.dumps(["Apr 1", "Apr 2", "Apr 3", "Apr 4", "Apr 5", "Apr 6", "Apr 7"]),
-        'started': json.dumps([3, 2, 5, 1, 4, 2, 3]),
-        'completed': json.dumps([1, 0, 2, 1, 1, 3, 2])
-    }
-    
-    # Technology usage data
-    tech_data = {
-        'labels': json.dumps(["React", "Flask", "Node.js", "PostgreSQL", "MongoDB", "Express", "Vue.js", "Django"]),
-        'counts': json.dumps([8, 12, 7, 9, 5, 6, 4, 3])
+    if redis_client is not None:
+        redis_client.setex(ANALYTICS_CACHE_KEY, ANALYTICS_CACHE_TTL, app.json.dumps(stats))
+    else:
+        set_cached(ANALYTICS_CACHE_KEY, stats, ANALYTICS_CACHE_TTL)
+    return stats
+
+def invalidate_analytics_cache():
+    """Drop the cached analytics stats after projects are added, removed or completed"""
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        redis_client.delete(ANALYTICS_CACHE_KEY)
+    clear_cache(ANALYTICS_CACHE_KEY)
+
+# Static analytics content, built and JSON-encoded once at import
+# Layer statistics for all 12 layers
+ANALYTICS_LAYER_STATS = {
+    'layer0': {'avg_time': 1, 'success_rate': 97, 'common_issue': 'Unclear requirements'},
+    'layer1': {'avg_time': 2, 'success_rate': 95, 'common_issue': 'Incomplete specifications'},
+    'layer2': {'avg_time': 3, 'success_rate': 90, 'common_issue': 'Research gaps'},
+    'layer3': {'avg_time': 4, 'success_rate': 88, 'common_issue': 'Incompatible technologies'},
+    'layer4': {'avg_time': 5, 'success_rate': 85, 'common_issue': 'Prototype limitations'},
+    'layer5': {'avg_time': 10, 'success_rate': 75, 'common_issue': 'Integration errors'},
+    'layer6': {'avg_time': 4, 'success_rate': 82, 'common_issue': 'Test coverage gaps'},
+    'layer7': {'avg_time': 6, 'success_rate': 80, 'common_issue': 'Security vulnerabilities'},
+    'layer8': {'avg_time': 3, 'success_rate': 92, 'common_issue': 'Configuration issues'},
+    'layer9': {'avg_time': 1, 'success_rate': 98, 'common_issue': 'File formatting issues'},
+    'layer10': {'avg_time': 2, 'success_rate': 94, 'common_issue': 'Monitoring setup problems'},
+    'layer11': {'avg_time': 3, 'success_rate': 91, 'common_issue': 'Maintenance planning gaps'}
+}
+
+# Project timeline data
+ANALYTICS_TIMELINE_DATA = {
+    'dates': app.json.dumps(["Apr 1", "Apr 2", "Apr 3", "Apr 4", "Apr 5", "Apr 6", "Apr 7"]),
+    'started': app.json.dumps([3, 2, 5, 1, 4, 2, 3]),
+    'completed': app.json.dumps([1, 0, 2, 1, 1, 3, 2])
+}
+
+# Technology usage data
+ANALYTICS_TECH_DATA = {
+    'labels': app.json.dumps(["React", "Flask", "Node.js", "PostgreSQL", "MongoDB", "Express", "Vue.js", "Django"]),
+    'counts': app.json.dumps([8, 12, 7, 9, 5, 6, 4, 3])
+}
+
+# Recent activity
+ANALYTICS_RECENT_ACTIVITY = [
+    {
+        'action': 'Project Completed',
+        'timestamp': '10 minutes ago',
+        'description': 'Task Management Application successfully completed all HACF layers',
+        'project': 'Task Management App'
+    },
+    {
+        'action': 'Layer 3 Processed',
+        'timestamp': '25 minutes ago',
+        'description': 'Development & Execution layer completed for E-commerce Website',
+        'project': 'E-commerce Website'
+    },
+    {
+        'action': 'New Project Created',
+        'timestamp': '1 hour ago',
+        'description': 'Started a new project: Blog Platform',
+        'project': 'Blog Platform'
+    },
+    {
+        'action': 'Code Optimized',
+        'timestamp': '2 hours ago',
+        'description': 'Security vulnerabilities fixed in authentication module',
+        'project': 'Weather App'
+    },
+    {
+        'action': 'Files Generated',
+        'timestamp': '3 hours ago',
+        'description': '15 files generated and exported as ZIP',
+        'project': 'Portfolio Website'
     }
+]
+
+# Popular technologies
+ANALYTICS_POPULAR_TECHNOLOGIES = [
+    {'name': 'Flask', 'count': 12},
+    {'name': 'PostgreSQL', 'count': 9},
+    {'name': 'React', 'count': 8},
+    {'name': 'Node.js', 'count': 7},
+    {'name': 'Express', 'count': 6},
+    {'name': 'MongoDB', 'count': 5},
+    {'name': 'Vue.js', 'count': 4},
+    {'name': 'Django', 'count': 3}
+]
+
+@app.route('/analytics')
+@login_required
+def analytics():
+    # Restrict analytics to admins and managers
+    if current_user.role not in ['admin', 'manager']:
+        flash('You do not have permission to access analytics.', 'danger')
+        return redirect(url_for('dashboard'))
     
-    # Recent activity
-    recent_activity = [
-        {
-            'action': 'Project Completed',
-            'timestamp': '10 minutes ago',
-            'description': 'Task Management Application successfully completed all HACF layers',
-            'project': 'Task Management App'
-        },
-        {
-            'action': 'Layer 3 Processed',
-            'timestamp': '25 minutes ago',
-            'description': 'Development & Execution layer completed for E-commerce Website',
-            'project': 'E-commerce Website'
-        },
-        {
-            'action': 'New Project Created',
-            'timestamp': '1 hour ago',
-            'description': 'Started a new project: Blog Platform',
-            'project': 'Blog Platform'
-        },
-        {
-            'action': 'Code Optimized',
-            'timestamp': '2 hours ago',
-            'description': 'Security vulnerabilities fixed in authentication module',
-            'project': 'Weather App'
-        },
-        {
-            'action': 'Files Generated',
-            'timestamp': '3 hours ago',
-            'description': '15 files generated and exported as ZIP',
-            'project': 'Portfolio Website'
-        }
-    ]
-    
-    # Popular technologies
-    popular_technologies = [
-        {'name': 'Flask', 'count': 12},
-        {'name': 'PostgreSQL', 'count': 9},
-        {'name': 'React', 'count': 8},
-        {'name': 'Node.js', 'count': 7},
-        {'name': 'Express', 'count': 6},
-        {'name': 'MongoDB', 'count': 5},
-        {'name': 'Vue.js', 'count': 4},
-        {'name': 'Django', 'count': 3}
-    ]
+    # Get basic stats
+    stats = _compute_analytics_stats()
     
-    return render_template(
+    # Stream the page so the first bytes go out while the rest renders
+    return stream_template(
         'analytics.html', 
         stats=stats, 
-        layer_stats=layer_stats,
-        timeline_data=timeline_data,
-        tech_data=tech_data,
-        recent_activity=recent_activity,
-        popular_technologies=popular_technologies
+        layer_stats=ANALYTICS_LAYER_STATS,
+        timeline_data=ANALYTICS_TIMELINE_DATA,
+        tech_data=ANALYTICS_TECH_DATA,
+        recent_activity=ANALYTICS_RECENT_ACTIVITY,
+        popular_technologies=ANALYTICS_POPULAR_TECHNOLOGIES
     )
 
 @app.route('/project/<int:project_id>')
 @login_required
 def project_detail(project_id):
-    project = models.Project.query.get_or_404(project_id)
+    project = db.get_or_404(models.Project, project_id)
     
     # Check if user is authorized to view this project
     if not current_user.role == 'admin' and project.user_id != current_user.id:
         flash('You do not have permission to view this project.', 'danger')
         return redirect(url_for('dashboard'))
     
-    # Determine the active layer in the 12-layer framework
-    active_layer = 0
-    if not project.layer0_complete:
-        active_layer = 0
-    elif project.layer0_complete and not project.layer1_complete:
-        active_layer = 1
-    elif project.layer1_complete and not project.layer2_complete:
-        active_layer = 2
-    elif project.layer2_complete and not project.layer3_complete:
-        active_layer = 3
-    elif project.layer3_complete and not project.layer4_complete:
-        active_layer = 4
-    elif project.layer4_complete and not project.layer5_complete:
-        active_layer = 5
-    elif project.layer5_complete and not project.layer6_complete:
-        active_layer = 6
-    elif project.layer6_complete and not project.layer7_complete:
-        active_layer = 7
-    elif project.layer7_complete and not project.layer8_complete:
-        active_layer = 8
-    elif project.layer8_complete and not project.layer9_complete:
-        active_layer = 9
-    elif project.layer9_complete and not project.layer10_complete:
-        active_layer = 10
-    elif project.layer10_complete and not project.layer11_complete:
-        active_layer = 11
-    elif project.layer11_complete:
-        active_layer = 11
-    
-    # Parse files if they exist
-    if project.files:
-        try:
-            project.files_list = json.loads(project.files)
-        except:
-            project.files_list = []
-    else:
-        project.files_list = []
-    
-    return render_template('project_detail.html', project=project, active_layer=active_layer)
+    return render_template('project_detail.html', project=project, active_layer=project.active_layer)
 
 @app.route('/create_project', methods=['POST'])
 @login_required
@@ -416,7 +533,7 @@ def create_project():
         title=title,
         description=description,
         user_id=current_user.id,
-        created_at=datetime.datetime.utcnow()
+        created_at=utcnow()
     )
     
     # Store project type and tech stack preferences in task_definition as JSON
@@ -425,10 +542,11 @@ def create_project():
         "tech_stack": tech_stack,
         "priority": priority
     }
-    project.task_definition = json.dumps(project_metadata)
+    project.task_definition = app.json.dumps(project_metadata)
     
     db.session.add(project)
     db.session.commit()
+    invalidate_analytics_cache()
     
     if request.is_json:
         return jsonify({
@@ -442,7 +560,7 @@ def create_project():
 @app.route('/edit_project/<int:project_id>', methods=['GET', 'POST'])
 @login_required
 def edit_project(project_id):
-    project = models.Project.query.get_or_404(project_id)
+    project = db.get_or_404(models.Project, project_id)
     
     # Check if user is authorized to edit this project
     if not current_user.role == 'admin' and project.user_id != current_user.id:
@@ -461,7 +579,7 @@ def edit_project(project_id):
 @app.route('/delete_project/<int:project_id>', methods=['POST'])
 @login_required
 def delete_project(project_id):
-    project = models.Project.query.get_or_404(project_id)
+    project = db.get_or_404(models.Project, project_id)
     
     # Check if user is authorized to delete this project
     if not current_user.role == 'admin' and project.user_id != current_user.id:
@@ -470,152 +588,309 @@ def delete_project(project_id):
     
     db.session.delete(project)
     db.session.commit()
+    invalidate_analytics_cache()
     
     flash('Project deleted successfully.', 'success')
     return redirect(url_for('dashboard'))
 
+# Legacy columns that mirror a layer's output, for backward compatibility
+LAYER_LEGACY_FIELDS = {
+    1: 'task_definition',
+    3: 'refined_structure',
+    5: 'development_code',
+    7: 'optimized_code',
+}
+
+# Placeholder files written when the file generation layer completes, encoded once
+DEFAULT_PROJECT_FILES_JSON = app.json.dumps([
+    {"name": "index.html", "content": "<html><body><h1>Hello World</h1></body></html>"},
+    {"name": "style.css", "content": "body { font-family: Arial; }"},
+    {"name": "script.js", "content": "console.log('Hello from HACF!');"}
+])
+
+# Background layer runs report their state here; Redis when available so any
+# worker can answer a status poll
+LAYER_TASK_KEY_PREFIX = 'layer_task:'
+LAYER_TASK_TTL = 3600  # seconds
+LAYER_TASK_WORKERS = int(os.environ.get('LAYER_TASK_WORKERS', 4))
+LAYER_TASK_QUEUE_SIZE = int(os.environ.get('LAYER_TASK_QUEUE_SIZE', 32))  # waiting runs
+
+# Bounded pool for background layer runs; the semaphore caps running plus
+# queued runs so a burst is turned away instead of piling up in memory
+_layer_task_executor = ThreadPoolExecutor(max_workers=LAYER_TASK_WORKERS, thread_name_prefix='layer-task')
+_layer_task_slots = threading.BoundedSemaphore(LAYER_TASK_WORKERS + LAYER_TASK_QUEUE_SIZE)
+
+def _set_layer_task(task_id, state):
+    """Record the state of a background layer run"""
+    key = f"{LAYER_TASK_KEY_PREFIX}{task_id}"
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        redis_client.setex(key, LAYER_TASK_TTL, app.json.dumps(state))
+    else:
+        set_cached(key, state, LAYER_TASK_TTL)
+
+def _get_layer_task(task_id):
+    """Get the recorded state of a background layer run, or None"""
+    key = f"{LAYER_TASK_KEY_PREFIX}{task_id}"
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        cached = redis_client.get(key)
+        return app.json.loads(cached) if cached is not None else None
+    return get_cached(key)
+
+def _layer_changes(layer_num, input_data):
+    """Column values written when a layer completes - 12 layer framework"""
+    changes = {
+        f'layer{layer_num}_output': input_data,
+        'layers_complete': models.Project.layers_complete.op('|')(1 << layer_num),
+    }
+    if layer_num in LAYER_LEGACY_FIELDS:
+        changes[LAYER_LEGACY_FIELDS[layer_num]] = input_data
+    if layer_num == 9:
+        # For file generation layer (previously layer 5)
+        changes['files'] = DEFAULT_PROJECT_FILES_JSON
+    return changes
+
+def _apply_layer(project_id, layer_num, input_data, owner_id=None):
+    """
+    Store a layer's output with one UPDATE and commit; returns the response payload
+    Only projects owned by owner_id match when it is given. Returns None when no
+    project matched, without loading the row either way.
+    """
+    # Process through Puter.js HACF layer (this would be done client-side in reality)
+    # Here we're just simulating the layer processing
+    
+    output = f"Processed layer {layer_num} for project {project_id}"
+    
+    stmt = (
+        db.update(models.Project)
+        .where(models.Project.id == project_id)
+        .values(**_layer_changes(layer_num, input_data))
+    )
+    if owner_id is not None:
+        stmt = stmt.where(models.Project.user_id == owner_id)
+    if db.session.execute(stmt).rowcount == 0:
+        db.session.rollback()
+        return None
+    
+    db.session.commit()
+    if layer_num == 11:
+        invalidate_analytics_cache()
+    
+    return {
+        "status": "success",
+        "message": f"Layer {layer_num} processed successfully",
+        "output": output
+    }
+
+def _process_layer_task(task_id, user_id, project_id, layer_num, input_data, owner_id):
+    """Run a layer outside the request and record how it went"""
+    with app.app_context():
+        try:
+            result = _apply_layer(project_id, layer_num, input_data, owner_id)
+            if result is None:
+                raise LookupError(f"Project {project_id} not found")
+            _set_layer_task(task_id, {"user_id": user_id, "state": "complete", "result": result})
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error processing layer {layer_num} for project {project_id}: {str(e)}")
+            _set_layer_task(task_id, {"user_id": user_id, "state": "failed", "error": str(e)})
+
+def _process_layer_denied(project_id):
+    """404 if the project does not exist, else the 403 response for process_layer"""
+    if not db.session.scalar(db.select(db.exists().where(models.Project.id == project_id))):
+        abort(404)
+    return jsonify({
+        "status": "error",
+        "message": "You do not have permission to process this project."
+    }), 403
+
 @app.route('/process_layer/<int:project_id>/<int:layer_num>', methods=['POST'])
 @login_required
 def process_layer(project_id, layer_num):
-    project = models.Project.query.get_or_404(project_id)
-    
-    # Check if user is authorized to process this project
-    if not current_user.role == 'admin' and project.user_id != current_user.id:
+    if layer_num not in range(12):
         return jsonify({
             "status": "error",
-            "message": "You do not have permission to process this project."
-        }), 403
+            "message": f"Unknown layer {layer_num}"
+        }), 400
+    
+    # Admins may process any project; everyone else only their own, which the
+    # UPDATE enforces in its WHERE clause
+    owner_id = None if current_user.role == 'admin' else current_user.id
     data = request.json or {}
     input_data = data.get('input', '')
     
-    try:
-        # Process through Puter.js HACF layer (this would be done client-side in reality)
-        # Here we're just simulating the layer processing
-        
-        output = f"Processed layer {layer_num} for project {project_id}"
-        
-        # Update project based on layer - 12 layer framework
-        if layer_num == 0:
-            project.layer0_output = input_data
-            project.layer0_complete = True
-        elif layer_num == 1:
-            project.layer1_output = input_data
-            project.task_definition = input_data  # For backward compatibility
-            project.layer1_complete = True
-        elif layer_num == 2:
-            project.layer2_output = input_data
-            project.layer2_complete = True
-        elif layer_num == 3:
-            project.layer3_output = input_data
-            project.refined_structure = input_data  # For backward compatibility
-            project.layer3_complete = True
-        elif layer_num == 4:
-            project.layer4_output = input_data
-            project.layer4_complete = True
-        elif layer_num == 5:
-            project.layer5_output = input_data
-            project.development_code = input_data  # For backward compatibility
-            project.layer5_complete = True
-        elif layer_num == 6:
-            project.layer6_output = input_data
-            project.layer6_complete = True
-        elif layer_num == 7:
-            project.layer7_output = input_data
-            project.optimized_code = input_data  # For backward compatibility
-            project.layer7_complete = True
-        elif layer_num == 8:
-            project.layer8_output = input_data
-            project.layer8_complete = True
-        elif layer_num == 9:
-            # For file generation layer (previously layer 5)
-            project.layer9_output = input_data
-            # Generate files
-            files = [
-                {"name": "index.html", "content": "<html><body><h1>Hello World</h1></body></html>"},
-                {"name": "style.css", "content": "body { font-family: Arial; }"},
-                {"name": "script.js", "content": "console.log('Hello from HACF!');"}
-            ]
-            project.files = json.dumps(files)
-            project.layer9_complete = True
-        elif layer_num == 10:
-            project.layer10_output = input_data
-            project.layer10_complete = True
-        elif layer_num == 11:
-            project.layer11_output = input_data
-            project.layer11_complete = True
-            project.completed_at = datetime.datetime.utcnow()
+    # With ?async=1 the layer runs in a background task and the client polls
+    # /process_layer/status/<task_id> instead of holding this worker thread
+    if request.args.get('async') == '1':
+        project_owner = db.session.scalar(
+            db.select(models.Project.user_id).where(models.Project.id == project_id)
+        )
+        if project_owner is None or (owner_id is not None and project_owner != owner_id):
+            return _process_layer_denied(project_id)
         
-        db.session.commit()
+        if not _layer_task_slots.acquire(blocking=False):
+            return jsonify({
+                "status": "error",
+                "message": "Too many layers are being processed; try again shortly."
+            }), 503
         
+        task_id = uuid.uuid4().hex
+        try:
+            _set_layer_task(task_id, {"user_id": current_user.id, "state": "pending"})
+            future = _layer_task_executor.submit(
+                _process_layer_task, task_id, current_user.id, project_id, layer_num, input_data, owner_id
+            )
+        except Exception:
+            _layer_task_slots.release()
+            raise
+        future.add_done_callback(lambda _: _layer_task_slots.release())
         return jsonify({
-            "status": "success",
-            "message": f"Layer {layer_num} processed successfully",
-            "output": output
-        })
+            "status": "accepted",
+            "task_id": task_id,
+            "status_url": url_for('process_layer_status', task_id=task_id)
+        }), 202
+    
+    try:
+        result = _apply_layer(project_id, layer_num, input_data, owner_id)
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error processing layer {layer_num} for project {project_id}: {str(e)}")
         return jsonify({
             "status": "error",
             "message": f"An error occurred: {str(e)}"
         }), 500
+    
+    if result is None:
+        return _process_layer_denied(project_id)
+    return jsonify(result)
+
+@app.route('/process_layer/status/<task_id>')
+@login_required
+def process_layer_status(task_id):
+    task = _get_layer_task(task_id)
+    if task is None or task["user_id"] != current_user.id:
+        return jsonify({
+            "status": "error",
+            "message": "Task not found"
+        }), 404
+    
+    return jsonify({key: value for key, value in task.items() if key != "user_id"})
+
+def _get_project_files(project_id):
+    """Load a project with only the columns the file views need, or 404"""
+    # The layer output columns can be large and these views never read them;
+    # files stays deferred so a 304 never loads it
+    project = db.session.get(
+        models.Project, project_id,
+        options=[load_only(models.Project.user_id, models.Project.title, models.Project.updated_at)]
+    )
+    if project is None:
+        abort(404)
+    return project
+
+def _project_files_etag(project, *parts):
+    """Weak ETag for a view of a project's files; changes whenever the project does"""
+    source = ':'.join(str(part) for part in (project.id, project.updated_at, *parts))
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+def _project_files_not_modified(etag):
+    """Return a 304 response if the client's cached copy matches etag, else None"""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+def _cache_project_files(response, etag, project):
+    """Mark a project file response as revalidatable by the user's browser only"""
+    response.set_etag(etag, weak=True)
+    response.last_modified = project.updated_at
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response
 
 @app.route('/project_file/<int:project_id>/<path:filename>')
 @login_required
 def project_file(project_id, filename):
-    project = models.Project.query.get_or_404(project_id)
+    project = _get_project_files(project_id)
     
     # Check if user is authorized to access this project's files
     if not current_user.role == 'admin' and project.user_id != current_user.id:
         return "Access denied", 403
     
-    if not project.files:
-        return "File not found", 404
+    etag = _project_files_etag(project, 'file', filename)
+    not_modified = _project_files_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
     
-    try:
-        files = json.loads(project.files)
-        for file in files:
-            if file['name'] == filename:
-                return file['content']
-        
+    content = project.files_by_name.get(filename)
+    if content is None:
         return "File not found", 404
-    except:
-        return "Error retrieving file", 500
+    return _cache_project_files(make_response(content), etag, project)
+
+class _ZipStreamBuffer:
+    """Write-only file object for zipfile that hands back what was written so far"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
 
 @app.route('/project_zip/<int:project_id>')
 @login_required
 def project_zip(project_id):
-    project = models.Project.query.get_or_404(project_id)
+    project = _get_project_files(project_id)
     
     # Check if user is authorized to download this project's files
     if not current_user.role == 'admin' and project.user_id != current_user.id:
         return "Access denied", 403
     
+    etag = _project_files_etag(project, 'zip')
+    not_modified = _project_files_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    
     if not project.files:
         return "No files to download", 404
     
-    try:
-        # Create a ZIP file in memory
-        memory_file = BytesIO()
-        with zipfile.ZipFile(memory_file, 'w') as zf:
-            files = json.loads(project.files)
-            for file in files:
-                zf.writestr(file['name'], file['content'])
-        
-        memory_file.seek(0)
-        return send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f"{project.title.replace(' ', '_')}_HACF_Project.zip"
-        )
-    except Exception as e:
-        logger.error(f"Error creating ZIP file for project {project_id}: {str(e)}")
-        return "Error creating ZIP file", 500
+    files = project.files_list
+    download_name = f"{project.title.replace(' ', '_')}_HACF_Project.zip"
+    
+    def generate():
+        # Compress one file at a time and send each piece as soon as it is written
+        buffer = _ZipStreamBuffer()
+        try:
+            with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+                for file in files:
+                    zf.writestr(file['name'], file['content'])
+                    yield buffer.drain()
+            yield buffer.drain()
+        except Exception as e:
+            logger.error(f"Error creating ZIP file for project {project_id}: {str(e)}")
+            raise
+    
+    response = Response(
+        generate(),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+    )
+    return _cache_project_files(response, etag, project)
 
 @app.route('/project_json/<int:project_id>')
 @login_required
 def project_json(project_id):
-    project = models.Project.query.get_or_404(project_id)
+    project = db.get_or_404(models.Project, project_id)
     
     # Check if user is authorized to access this project's data
     if not current_user.role == 'admin' and project.user_id != current_user.id:
@@ -661,7 +936,7 @@ def project_json(project_id):
         "layer10_complete": project.layer10_complete,
         "layer11_complete": project.layer11_complete,
         # Files and dates
-        "files": json.loads(project.files) if project.files else [],
+        "files": project.files_list,
         "created_at": project.created_at.isoformat() if project.created_at else None,
         "updated_at": project.updated_at.isoformat() if project.updated_at else None,
         "completed_at": project.completed_at.isoformat() if project.completed_at else None,
@@ -670,6 +945,18 @@ def project_json(project_id):
     
     return jsonify(project_data)
 
+# Conversation history lives in Redis when available; the session cookie only
+# carries the conversation id
+CONVERSATION_KEY_PREFIX = 'conv:'
+CONVERSATION_TTL = 86400  # seconds
+MAX_HISTORY = 50  # turns kept per conversation
+
+def _conversation_key():
+    """Get the Redis key of the current session's conversation"""
+    if 'conversation_id' not in session:
+        session['conversation_id'] = uuid.uuid4().hex
+    return f"{CONVERSATION_KEY_PREFIX}{session['conversation_id']}"
+
 @app.route('/chat', methods=['POST'])
 @login_required
 def chat():
@@ -679,22 +966,34 @@ def chat():
         response = data.get('response', '')
         metadata = data.get('metadata', None)
         
-        # Store conversation history in session
-        if 'conversation' not in session:
-            session['conversation'] = []
-        
-        # Add user message to conversation history
-        session['conversation'].append({
-            "role": "user", 
-            "content": message
-        })
+        turns = [
+            # User message
+            {
+                "role": "user", 
+                "content": message
+            },
+            # Assistant response
+            {
+                "role": "assistant", 
+                "content": response,
+                "metadata": metadata
+            }
+        ]
         
-        # Add assistant response to conversation history
-        session['conversation'].append({
-            "role": "assistant", 
-            "content": response,
-            "metadata": metadata
-        })
+        # Store conversation history
+        redis_client = get_redis_client()
+        if redis_client is not None:
+            key = _conversation_key()
+            pipe = redis_client.pipeline()
+            pipe.rpush(key, *[app.json.dumps(turn) for turn in turns])
+            pipe.ltrim(key, -MAX_HISTORY, -1)
+            pipe.expire(key, CONVERSATION_TTL)
+            pipe.execute()
+        else:
+            conversation = session.get('conversation', [])
+            conversation.extend(turns)
+            session['conversation'] = conversation[-MAX_HISTORY:]
+            session.modified = True
         
         # In a real implementation with server-side processing, we could call different AI models here
         # based on the HACF layer required. For now, we're using Puter.js on the client side.
@@ -715,7 +1014,11 @@ def chat():
 @app.route('/get_conversation', methods=['GET'])
 @login_required
 def get_conversation():
-    conversation = session.get('conversation', [])
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        conversation = [app.json.loads(turn) for turn in redis_client.lrange(_conversation_key(), 0, -1)]
+    else:
+        conversation = session.get('conversation', [])
     return jsonify({
         "conversation": conversation
     })
@@ -723,6 +1026,9 @@ def get_conversation():
 @app.route('/clear_conversation', methods=['POST'])
 @login_required
 def clear_conversation():
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        redis_client.delete(_conversation_key())
     if 'conversation' in session:
         session.pop('conversation')
     return jsonify({
@@ -763,7 +1069,7 @@ def update_preferences():
         # Handle preferred technologies (comes as a list from form)
         tech_list = request.form.getlist('preferred_technologies[]')
         if tech_list:
-            current_user.preferred_technologies = json.dumps(tech_list)
+            current_user.preferred_technologies = app.json.dumps(tech_list)
         
         db.session.commit()
         
@@ -807,12 +1113,12 @@ def change_password():
 @login_required
 def generate_api_key():
     try:
-        import secrets
         # Generate a random API key
         api_key = secrets.token_hex(32)
         
-        current_user.api_key = api_key
+        current_user.set_api_key(api_key)
         db.session.commit()
+        session['new_api_key'] = api_key
         
         flash('API key generated successfully.', 'success')
     except Exception as e:
@@ -825,12 +1131,12 @@ def generate_api_key():
 @login_required
 def regenerate_api_key():
     try:
-        import secrets
         # Generate a new random API key
         api_key = secrets.token_hex(32)
         
-        current_user.api_key = api_key
+        current_user.set_api_key(api_key)
         db.session.commit()
+        session['new_api_key'] = api_key
         
         flash('API key regenerated successfully.', 'success')
     except Exception as e:
@@ -852,23 +1158,23 @@ def create_team():
             flash('Team name is required.', 'danger')
             return redirect(url_for('profile'))
         
-        # Create new team
-        team = models.Team(
-            name=name,
-            description=description,
-            avatar=avatar,
-            owner_id=current_user.id
-        )
-        db.session.add(team)
-        db.session.flush()  # Flush to get the team ID
+        # Create new team, taking its ID from RETURNING rather than a flush
+        team_id = db.session.execute(
+            db.insert(models.Team)
+            .values(
+                name=name,
+                description=description,
+                avatar=avatar,
+                owner_id=current_user.id
+            )
+            .returning(models.Team.id)
+        ).scalar()
         
         # Add current user as owner
-        team_member = models.TeamMember(
-            team_id=team.id,
-            user_id=current_user.id,
-            role='owner'
+        db.session.execute(
+            db.insert(models.TeamMember)
+            .values(team_id=team_id, user_id=current_user.id, role='owner')
         )
-        db.session.add(team_member)
         
         db.session.commit()
         
@@ -883,31 +1189,46 @@ def create_team():
 @app.route('/team/<int:team_id>')
 @login_required
 def team_detail(team_id):
-    # Get team information
-    team = models.Team.query.get_or_404(team_id)
+    # Get team information with its members and projects loaded up front
+    team = db.session.scalars(
+        db.select(models.Team)
+        .where(models.Team.id == team_id)
+        .options(
+            selectinload(models.Team.members),
+            selectinload(models.Team.projects).joinedload(models.TeamProject.project)
+        )
+    ).first()
+    if team is None:
+        abort(404)
     
     # Check if user is a member of the team
-    team_member = models.TeamMember.query.filter_by(team_id=team_id, user_id=current_user.id).first()
+    team_member = next((member for member in team.members if member.user_id == current_user.id), None)
     
     if not team_member and team.owner_id != current_user.id and current_user.role != 'admin':
         flash('You are not a member of this team.', 'danger')
         return redirect(url_for('profile'))
     
-    # Get team members
-    members = models.TeamMember.query.filter_by(team_id=team_id).all()
-    
-    # Get team projects
-    team_projects = models.TeamProject.query.filter_by(team_id=team_id).all()
-    
-    return render_template('team_detail.html', team=team, members=members, team_projects=team_projects, current_member=team_member)
+    return render_template('team_detail.html', team=team, members=team.members, team_projects=team.projects, current_member=team_member)
+
+def _get_team_members(team_id, *options):
+    """Load a team with its members, or 404; returns (team, members keyed by user id)"""
+    team = db.session.scalars(
+        db.select(models.Team)
+        .where(models.Team.id == team_id)
+        .options(selectinload(models.Team.members), *options)
+    ).first()
+    if team is None:
+        abort(404)
+    return team, {member.user_id: member for member in team.members}
 
 @app.route('/team/<int:team_id>/invite', methods=['POST'])
 @login_required
+@user_rate_limited('invite_team_member')
 def invite_team_member(team_id):
-    team = models.Team.query.get_or_404(team_id)
+    team, members = _get_team_members(team_id)
     
     # Check if user is authorized to invite members
-    team_member = models.TeamMember.query.filter_by(team_id=team_id, user_id=current_user.id).first()
+    team_member = members.get(current_user.id)
     
     if not team_member or team_member.role not in ['owner', 'admin']:
         flash('You do not have permission to invite members to this team.', 'danger')
@@ -920,39 +1241,41 @@ def invite_team_member(team_id):
         flash('Email is required.', 'danger')
         return redirect(url_for('team_detail', team_id=team_id))
     
+    if role not in models.ASSIGNABLE_TEAM_ROLES:
+        flash('Invalid role.', 'danger')
+        return redirect(url_for('team_detail', team_id=team_id))
+    
     # Find user by email
-    user = models.User.query.filter_by(email=email).first()
+    user = db.session.scalars(db.select(models.User).filter_by(email=email)).first()
     
     if not user:
         flash(f'No user found with email {email}.', 'danger')
         return redirect(url_for('team_detail', team_id=team_id))
     
-    # Check if user is already a member
-    existing_member = models.TeamMember.query.filter_by(team_id=team_id, user_id=user.id).first()
+    # Add user to team unless they are already a member
+    added = db.session.execute(
+        pg_insert(models.TeamMember)
+        .values(team_id=team_id, user_id=user.id, role=role)
+        .on_conflict_do_nothing(index_elements=['team_id', 'user_id'])
+        .returning(models.TeamMember.id)
+    ).first()
+    db.session.commit()
     
-    if existing_member:
+    if added is None:
         flash(f'User {user.username} is already a member of this team.', 'warning')
         return redirect(url_for('team_detail', team_id=team_id))
     
-    # Add user to team
-    new_member = models.TeamMember(
-        team_id=team_id,
-        user_id=user.id,
-        role=role
-    )
-    db.session.add(new_member)
-    db.session.commit()
-    
     flash(f'User {user.username} invited to the team successfully.', 'success')
     return redirect(url_for('team_detail', team_id=team_id))
 
 @app.route('/team/<int:team_id>/remove/<int:user_id>', methods=['POST'])
 @login_required
+@user_rate_limited('remove_team_member')
 def remove_team_member(team_id, user_id):
-    team = models.Team.query.get_or_404(team_id)
+    team, members = _get_team_members(team_id)
     
     # Check if user is authorized to remove members
-    team_member = models.TeamMember.query.filter_by(team_id=team_id, user_id=current_user.id).first()
+    team_member = members.get(current_user.id)
     
     if not team_member or team_member.role not in ['owner', 'admin']:
         flash('You do not have permission to remove members from this team.', 'danger')
@@ -964,7 +1287,7 @@ def remove_team_member(team_id, user_id):
         return redirect(url_for('team_detail', team_id=team_id))
     
     # Find the member to remove
-    member_to_remove = models.TeamMember.query.filter_by(team_id=team_id, user_id=user_id).first()
+    member_to_remove = members.get(user_id)
     
     if not member_to_remove:
         flash('Member not found.', 'danger')
@@ -976,18 +1299,82 @@ def remove_team_member(team_id, user_id):
     flash('Member removed successfully.', 'success')
     return redirect(url_for('team_detail', team_id=team_id))
 
+# Template listings change rarely, so the columns the templates page shows are
+# cached in Redis (or the process cache without it) and dropped on writes
+TEMPLATES_CACHE_PREFIX = 'templates:'
+TEMPLATES_CACHE_TTL = 60  # seconds
+TEMPLATE_LIST_COLUMNS = (
+    models.ProjectTemplate.id,
+    models.ProjectTemplate.user_id,
+    models.ProjectTemplate.name,
+    models.ProjectTemplate.description,
+    models.ProjectTemplate.configuration,
+    models.ProjectTemplate.is_public,
+    models.ProjectTemplate.category,
+    models.ProjectTemplate.tags,
+    models.ProjectTemplate.use_count,
+    models.ProjectTemplate.rating,
+    models.ProjectTemplate.rating_count,
+    models.User.username,
+)
+
+def _template_list(cache_key, *criteria):
+    """Get the templates matching criteria as dicts, querying at most once per TTL"""
+    cache_key = f"{TEMPLATES_CACHE_PREFIX}{cache_key}"
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        cached = redis_client.get(cache_key)
+        if cached is not None:
+            return app.json.loads(cached)
+    else:
+        cached = get_cached(cache_key)
+        if cached is not None:
+            return cached
+    
+    templates = [
+        dict(row) for row in db.session.execute(
+            db.select(*TEMPLATE_LIST_COLUMNS)
+            # Owner names come from the same query rather than a lookup per card
+            .join(models.User, models.User.id == models.ProjectTemplate.user_id)
+            .where(*criteria)
+            .order_by(models.ProjectTemplate.id)
+        ).mappings()
+    ]
+    
+    if redis_client is not None:
+        redis_client.setex(cache_key, TEMPLATES_CACHE_TTL, app.json.dumps(templates))
+    else:
+        set_cached(cache_key, templates, TEMPLATES_CACHE_TTL)
+    return templates
+
+def invalidate_template_cache(user_id):
+    """Drop the cached public listing and the owner's listing after a template changes"""
+    keys = [f"{TEMPLATES_CACHE_PREFIX}public", f"{TEMPLATES_CACHE_PREFIX}user:{user_id}"]
+    redis_client = get_redis_client()
+    if redis_client is not None:
+        redis_client.delete(*keys)
+    for key in keys:
+        clear_cache(key)
+
+def _parse_tags(tags):
+    """Split a comma-separated tag field into a list of trimmed, non-empty tags"""
+    return [tag.strip() for tag in tags.split(',') if tag.strip()]
+
 # Project Template Routes
 @app.route('/templates')
 @login_required
 def project_templates():
     # Get public templates and user's own templates
-    public_templates = models.ProjectTemplate.query.filter_by(is_public=True).all()
-    user_templates = models.ProjectTemplate.query.filter_by(user_id=current_user.id).all()
+    public_templates = _template_list('public', models.ProjectTemplate.is_public)
+    user_templates = _template_list(
+        f"user:{current_user.id}", models.ProjectTemplate.user_id == current_user.id
+    )
     
     return render_template('templates.html', public_templates=public_templates, user_templates=user_templates)
 
 @app.route('/create_template', methods=['POST'])
 @login_required
+@user_rate_limited('create_template')
 def create_template():
     try:
         name = request.form.get('name')
@@ -1008,11 +1395,12 @@ def create_template():
             configuration=configuration,
             is_public=is_public,
             category=category,
-            tags=json.dumps(tags.split(',')) if tags else '[]',
+            tags=_parse_tags(tags),
             user_id=current_user.id
         )
         db.session.add(template)
         db.session.commit()
+        invalidate_template_cache(current_user.id)
         
         flash(f'Template "{name}" created successfully.', 'success')
     except Exception as e:
@@ -1023,9 +1411,10 @@ def create_template():
 
 @app.route('/use_template/<int:template_id>', methods=['POST'])
 @login_required
+@user_rate_limited('use_template')
 def use_template(template_id):
     try:
-        template = models.ProjectTemplate.query.get_or_404(template_id)
+        template = db.get_or_404(models.ProjectTemplate, template_id)
         
         # Check if user has access to this template
         if not template.is_public and template.user_id != current_user.id and current_user.role != 'admin':
@@ -1040,7 +1429,7 @@ def use_template(template_id):
             title=project_title,
             description=project_description,
             user_id=current_user.id,
-            created_at=datetime.datetime.utcnow()
+            created_at=utcnow()
         )
         
         # Set task definition from template configuration
@@ -1052,6 +1441,7 @@ def use_template(template_id):
         template.use_count += 1
         
         db.session.commit()
+        invalidate_analytics_cache()
         
         flash(f'Project created from template "{template.name}".', 'success')
         return redirect(url_for('project_detail', project_id=project.id))
@@ -1063,9 +1453,10 @@ def use_template(template_id):
 
 @app.route('/edit_template/<int:template_id>', methods=['POST'])
 @login_required
+@user_rate_limited('edit_template')
 def edit_template(template_id):
     try:
-        template = models.ProjectTemplate.query.get_or_404(template_id)
+        template = db.get_or_404(models.ProjectTemplate, template_id)
         
         # Check if user is authorized to edit this template
         if template.user_id != current_user.id and current_user.role != 'admin':
@@ -1080,9 +1471,10 @@ def edit_template(template_id):
         
         # Handle tags
         tags = request.form.get('tags', '')
-        template.tags = json.dumps(tags.split(',')) if tags else '[]'
+        template.tags = _parse_tags(tags)
         
         db.session.commit()
+        invalidate_template_cache(template.user_id)
         
         flash(f'Template "{template.name}" updated successfully.', 'success')
     except Exception as e:
@@ -1093,17 +1485,20 @@ def edit_template(template_id):
 
 @app.route('/delete_template/<int:template_id>', methods=['POST'])
 @login_required
+@user_rate_limited('delete_template')
 def delete_template(template_id):
     try:
-        template = models.ProjectTemplate.query.get_or_404(template_id)
+        template = db.get_or_404(models.ProjectTemplate, template_id)
         
         # Check if user is authorized to delete this template
         if template.user_id != current_user.id and current_user.role != 'admin':
             flash('You do not have permission to delete this template.', 'danger')
             return redirect(url_for('project_templates'))
         
+        owner_id = template.user_id
         db.session.delete(template)
         db.session.commit()
+        invalidate_template_cache(owner_id)
         
         flash('Template deleted successfully.', 'success')
     except Exception as e:
@@ -1114,13 +1509,12 @@ def delete_template(template_id):
 
 @app.route('/team/<int:team_id>/add_project', methods=['POST'])
 @login_required
+@user_rate_limited('add_project_to_team')
 def add_project_to_team(team_id):
-    team = models.Team.query.get_or_404(team_id)
+    team, members = _get_team_members(team_id)
     
     # Check if user is a member of the team
-    team_member = models.TeamMember.query.filter_by(team_id=team_id, user_id=current_user.id).first()
-    
-    if not team_member:
+    if current_user.id not in members:
         flash('You are not a member of this team.', 'danger')
         return redirect(url_for('profile'))
     
@@ -1131,27 +1525,25 @@ def add_project_to_team(team_id):
         return redirect(url_for('team_detail', team_id=team_id))
     
     # Verify project exists and user owns it
-    project = models.Project.query.get_or_404(project_id)
+    project = db.get_or_404(models.Project, project_id)
     
     if project.user_id != current_user.id and current_user.role != 'admin':
         flash('You do not have permission to share this project.', 'danger')
         return redirect(url_for('team_detail', team_id=team_id))
     
-    # Check if project is already added to the team
-    existing_team_project = models.TeamProject.query.filter_by(team_id=team_id, project_id=project_id).first()
+    # Add project to team unless it is already part of it
+    added = db.session.execute(
+        pg_insert(models.TeamProject)
+        .values(team_id=team_id, project_id=project.id)
+        .on_conflict_do_nothing(index_elements=['team_id', 'project_id'])
+        .returning(models.TeamProject.id)
+    ).first()
+    db.session.commit()
     
-    if existing_team_project:
+    if added is None:
         flash('This project is already part of the team.', 'warning')
         return redirect(url_for('team_detail', team_id=team_id))
     
-    # Add project to team
-    team_project = models.TeamProject(
-        team_id=team_id,
-        project_id=project_id
-    )
-    db.session.add(team_project)
-    db.session.commit()
-    
     flash('Project added to team successfully.', 'success')
     return redirect(url_for('team_detail', team_id=team_id))
 
@@ -1173,20 +1565,19 @@ except ImportError as e:
 
 # Import and register SSO blueprint
 try:
-    from sso import sso as sso_blueprint
+    from sso import sso as sso_blueprint, get_available_sso_providers
     app.register_blueprint(sso_blueprint)
     logger.info("SSO Blueprint registered successfully")
 except ImportError as e:
+    get_available_sso_providers = None
     logger.error(f"Error importing SSO blueprint: {str(e)}")
 
 # Add SSO login data to the login context
 @app.context_processor
 def inject_sso_providers():
-    try:
-        from sso import get_available_sso_providers
-        return {'sso_providers': get_available_sso_providers()}
-    except ImportError:
+    if get_available_sso_providers is None:
         return {'sso_providers': []}
+    return {'sso_providers': get_available_sso_providers()}
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
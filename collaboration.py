@@ -93,7 +93,7 @@ class CollaborationManager:
                     'description': project.description,
                     'owner_id': project.user_id,
                     'owner_name': owner_name,
-                    'progress': project.progress(),
+                    'progress': project.progress,
                     'created_at': project.created_at.isoformat() if project.created_at else None,
                     'updated_at': project.updated_at.isoformat() if project.updated_at else None,
                     'layer1_complete': project.layer1_complete,
@@ -386,6 +386,9 @@ class CollaborationManager:
             created_by=user_id
         )
         
+        # Bump the project so cached copies (ETags) see the new version
+        project.updated_at = datetime.datetime.utcnow()
+        
         try:
             db.session.add(version)
             db.session.commit()
@@ -0,0 +1,16 @@
+import multiprocessing
+import os
+
+# Production server settings, picked up by running `gunicorn` from the project root
+wsgi_app = "main:app"
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Requests mostly wait on PostgreSQL, Redis and outbound HTTP, so each worker
+# process serves several of them at once on threads
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+# Keep client connections open between requests instead of reconnecting
+keepalive = 5
+timeout = 120
@@ -25,7 +25,7 @@ class KnowledgeBase:
         try:
             # If project has files, analyze them for reusable patterns
             if project.files:
-                files = json.loads(project.files)
+                files = project.files_list
                 
                 for file in files:
                     # Extract filename and extension
@@ -193,7 +193,7 @@ class DocumentationGenerator:
             # Files section
             if project.files:
                 try:
-                    files = json.loads(project.files)
+                    files = project.files_list
                     file_list = [file.get('name') for file in files if file.get('name')]
                     
                     documentation['sections'].append({
@@ -1,45 +1,136 @@
 from app import db
 from datetime import datetime
+from functools import cached_property
+import hashlib
+import threading
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import DDL, event
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.types import LargeBinary, TypeDecorator
+from sqlalchemy.dialects.postgresql import JSONB
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 import json
 from typing import Dict, List, Any, Optional
+import zstandard
+
+# argon2id with the library's recommended parameters
+password_hasher = PasswordHasher()
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+class CompressedText(TypeDecorator):
+    """
+    Text stored zstd-compressed in a bytea column
+    Reads also accept uncompressed UTF-8, so rows converted from the old text
+    column keep working until they are next written.
+    """
+    impl = LargeBinary
+    cache_ok = True
+    
+    # zstd contexts are not thread-safe, so each thread gets its own pair
+    _contexts = threading.local()
+    
+    @classmethod
+    def _context(cls):
+        if not hasattr(cls._contexts, 'compressor'):
+            cls._contexts.compressor = zstandard.ZstdCompressor(level=3)
+            cls._contexts.decompressor = zstandard.ZstdDecompressor()
+        return cls._contexts
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return self._context().compressor.compress(value.encode())
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        value = bytes(value)
+        if value.startswith(ZSTD_MAGIC):
+            return self._context().decompressor.decompress(value).decode()
+        return value.decode()
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256))
-    conversations = db.relationship('Conversation', backref='user', lazy=True, foreign_keys='Conversation.user_id')
-    projects = db.relationship('Project', backref='user', lazy=True, foreign_keys='Project.user_id')
+    conversations = db.relationship('Conversation', back_populates='user', lazy=True, foreign_keys='Conversation.user_id')
+    projects = db.relationship('Project', back_populates='user', lazy=True, foreign_keys='Project.user_id')
     
     # Role-based access control field - add this column to the database
     role = db.Column(db.String(20), default='user')  # 'user', 'admin', 'manager'
-    
+
+    # API access fields
+    api_key_hash = db.Column(db.LargeBinary(32), unique=True, index=True, nullable=True)  # SHA-256 of the key; the key itself is never stored
+    api_quota = db.Column(db.Integer, nullable=False, default=1000, server_default='1000')  # Allowed API calls per billing period
+    api_usage_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Flushed from Redis when available
+
     def set_password(self, password):
         """Set password hash"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = User.hash_password(password)
         
     def check_password(self, password):
         """Check password against hash"""
-        return check_password_hash(self.password_hash, password)
+        return User.verify_password(self.password_hash, password)
+    
+    @property
+    def password_needs_rehash(self):
+        """Whether the stored hash is legacy PBKDF2/scrypt or uses outdated argon2 parameters"""
+        if not self.password_hash or not self.password_hash.startswith('$argon2'):
+            return True
+        return password_hasher.check_needs_rehash(self.password_hash)
+    
+    @staticmethod
+    def hash_password(password):
+        """Hash a password with argon2id"""
+        return password_hasher.hash(password)
+    
+    @staticmethod
+    def verify_password(password_hash, password):
+        """Check a password against an argon2 hash, or a legacy werkzeug hash"""
+        if not password_hash:
+            return False
+        if not password_hash.startswith('$argon2'):
+            return check_password_hash(password_hash, password)
+        try:
+            return password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    
+    @staticmethod
+    def hash_api_key(api_key):
+        """Hash an API key for storage and lookup"""
+        return hashlib.sha256(api_key.encode()).digest()
+    
+    def set_api_key(self, api_key):
+        """Set API key hash"""
+        self.api_key_hash = User.hash_api_key(api_key)
+    
+    @property
+    def has_api_key(self):
+        """Whether the user has an API key"""
+        return self.api_key_hash is not None
     
     def __repr__(self):
         return f'<User {self.username}>'
 
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    messages = db.relationship('Message', backref='conversation', lazy=True)
+    user = db.relationship('User', back_populates='conversations', foreign_keys=[user_id])
+    messages = db.relationship('Message', back_populates='conversation', lazy=True)
     
     def __repr__(self):
         return f'<Conversation {self.id}>'
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, index=True)
     content = db.Column(db.Text, nullable=False)
     is_user = db.Column(db.Boolean, default=True)  # True if from user, False if from AI
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -49,9 +140,33 @@ class Message(db.Model):
     hacf_layer_number = db.Column(db.Integer, nullable=True)  # Numerical identifier for the layer (1-5)
     layer_metadata = db.Column(db.Text, nullable=True)  # Additional metadata from layer processing
     
+    conversation = db.relationship('Conversation', back_populates='messages')
+    
     def __repr__(self):
         return f'<Message {self.id}>'
 
+PROJECT_LAYERS = 12
+
+def _layer_flag(layer):
+    """Boolean view of one bit of Project.layers_complete, usable in queries and updates"""
+    bit = 1 << layer
+    
+    def fget(self):
+        return bool((self.layers_complete or 0) & bit)
+    
+    def fset(self, value):
+        mask = self.layers_complete or 0
+        self.layers_complete = mask | bit if value else mask & ~bit
+    
+    def expr(cls):
+        return cls.layers_complete.op('&')(bit) != 0
+    
+    def update_expr(cls, value):
+        mask = cls.layers_complete.op('|')(bit) if value else cls.layers_complete.op('&')(~bit)
+        return [(cls.layers_complete, mask)]
+    
+    return hybrid_property(fget, fset, expr=expr, update_expr=update_expr)
+
 class Project(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
@@ -77,49 +192,97 @@ class Project(db.Model):
     refined_structure = db.Column(db.Text)  # Legacy: Layer 2
     development_code = db.Column(db.Text)  # Legacy: Layer 3
     optimized_code = db.Column(db.Text)  # Legacy: Layer 4
-    files = db.Column(db.Text)  # Legacy: JSON string of files generated - Layer 5
-    
-    # Layered process flags - 12 layer framework
-    layer0_complete = db.Column(db.Boolean, default=False)
-    layer1_complete = db.Column(db.Boolean, default=False)
-    layer2_complete = db.Column(db.Boolean, default=False)
-    layer3_complete = db.Column(db.Boolean, default=False)
-    layer4_complete = db.Column(db.Boolean, default=False)
-    layer5_complete = db.Column(db.Boolean, default=False)
-    layer6_complete = db.Column(db.Boolean, default=False)
-    layer7_complete = db.Column(db.Boolean, default=False)
-    layer8_complete = db.Column(db.Boolean, default=False)
-    layer9_complete = db.Column(db.Boolean, default=False)
-    layer10_complete = db.Column(db.Boolean, default=False)
-    layer11_complete = db.Column(db.Boolean, default=False)
+    files = db.Column(CompressedText)  # Legacy: JSON string of files generated - Layer 5 (zstd in the database)
+    
+    # Layered process flags - 12 layer framework, bit n set when layer n is complete
+    layers_complete = db.Column(db.SmallInteger, nullable=False, default=0, server_default='0')
+    layer0_complete = _layer_flag(0)
+    layer1_complete = _layer_flag(1)
+    layer2_complete = _layer_flag(2)
+    layer3_complete = _layer_flag(3)
+    layer4_complete = _layer_flag(4)
+    layer5_complete = _layer_flag(5)
+    layer6_complete = _layer_flag(6)
+    layer7_complete = _layer_flag(7)
+    layer8_complete = _layer_flag(8)
+    layer9_complete = _layer_flag(9)
+    layer10_complete = _layer_flag(10)
+    layer11_complete = _layer_flag(11)
     
     # Date tracking
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    completed_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True, server_onupdate=db.FetchedValue())  # Set by trigger
+    
+    # Completion percentage based on completed layers, maintained by the database
+    progress = db.Column(db.Float, db.Computed(
+        "(" + " + ".join(f"((layers_complete >> {n}) & 1)" for n in range(PROJECT_LAYERS)) + f")::float8 * 100 / {PROJECT_LAYERS}",
+        persisted=True
+    ))
+    
+    # First layer not yet complete, or the last layer once all are done
+    active_layer = db.Column(db.SmallInteger, db.Computed(
+        "CASE " + " ".join(f"WHEN layers_complete & {1 << n} = 0 THEN {n}" for n in range(PROJECT_LAYERS - 1))
+        + f" ELSE {PROJECT_LAYERS - 1} END",
+        persisted=True
+    ))
+    
+    user = db.relationship('User', back_populates='projects', foreign_keys=[user_id])
+    
+    __table_args__ = (
+        # Serves the per-user keyset pagination in the projects API
+        db.Index('ix_project_user_id', 'user_id', 'id'),
+        # Lets per-user dashboards group and filter projects by stage from the index
+        db.Index('ix_project_user_active_layer', 'user_id', 'active_layer'),
+        db.Index('ix_project_completed_at', 'completed_at', postgresql_where=db.text('completed_at IS NOT NULL')),
+    )
+    
+    @cached_property
+    def files_list(self):
+        """
+        Generated files parsed from the files JSON, decoded once per instance
+        Entries without a string name and content are skipped; rows written before
+        writes were validated, or restored from old versions, may contain them.
+        """
+        if not self.files:
+            return []
+        try:
+            files = json.loads(self.files)
+        except ValueError:
+            return []
+        if not isinstance(files, list):
+            return []
+        return [
+            file for file in files
+            if isinstance(file, dict)
+            and isinstance(file.get('name'), str)
+            and isinstance(file.get('content'), str)
+        ]
+    
+    @cached_property
+    def files_by_name(self):
+        """Generated file contents keyed by file name"""
+        return {file['name']: file['content'] for file in self.files_list}
     
     def __repr__(self):
         return f'<Project {self.title}>'
-    
-    @property
-    def progress(self):
-        """Calculate project completion percentage based on completed layers"""
-        completed_layers = sum([
-            self.layer0_complete,
-            self.layer1_complete,
-            self.layer2_complete,
-            self.layer3_complete,
-            self.layer4_complete,
-            self.layer5_complete,
-            self.layer6_complete,
-            self.layer7_complete,
-            self.layer8_complete,
-            self.layer9_complete,
-            self.layer10_complete,
-            self.layer11_complete
-        ])
-        return (completed_layers / 12) * 100
-        
+
+# Stamp completed_at when the API's final layer (5) or the pipeline's (11) completes
+event.listen(Project.__table__, 'after_create', DDL("""
+CREATE OR REPLACE FUNCTION project_set_completed_at() RETURNS trigger AS $$
+BEGIN
+    IF NEW.layers_complete & ((1 << 5) | (1 << 11)) <> 0 AND NEW.completed_at IS NULL THEN
+        NEW.completed_at := now() AT TIME ZONE 'utc';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER project_completed_at
+BEFORE INSERT OR UPDATE OF layers_complete ON project
+FOR EACH ROW EXECUTE FUNCTION project_set_completed_at();
+""").execute_if(dialect='postgresql'))
+
 # Project Template model for saving and reusing project configurations
 class ProjectTemplate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -129,7 +292,7 @@ class ProjectTemplate(db.Model):
     configuration = db.Column(db.Text, nullable=False)  # JSON string of project configuration
     is_public = db.Column(db.Boolean, default=False)  # Whether template is shared publicly
     category = db.Column(db.String(50), default='general')  # Category for templates (web, mobile, etc.)
-    tags = db.Column(db.Text, nullable=True)  # JSON string of tags
+    tags = db.Column(JSONB, nullable=True)  # List of tags
     
     # Usage metrics
     use_count = db.Column(db.Integer, default=0)  # Number of times template has been used
@@ -152,10 +315,10 @@ class Team(db.Model):
     avatar = db.Column(db.String(255), nullable=True)  # URL to team avatar
     
     # Team members through TeamMember relationship
-    members = db.relationship('TeamMember', backref='team', lazy=True, cascade='all, delete-orphan')
+    members = db.relationship('TeamMember', back_populates='team', lazy=True, cascade='all, delete-orphan')
     
     # Team projects through TeamProject relationship
-    projects = db.relationship('TeamProject', backref='team', lazy=True, cascade='all, delete-orphan')
+    projects = db.relationship('TeamProject', back_populates='team', lazy=True, cascade='all, delete-orphan')
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -163,6 +326,9 @@ class Team(db.Model):
     def __repr__(self):
         return f'<Team {self.name}>'
 
+# Roles that can be granted when adding members; ownership moves only by transfer
+ASSIGNABLE_TEAM_ROLES = frozenset({'admin', 'member', 'viewer'})
+
 class TeamMember(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False)
@@ -170,8 +336,15 @@ class TeamMember(db.Model):
     role = db.Column(db.String(20), default='member')  # 'owner', 'admin', 'member', 'viewer'
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # To ensure a user can be a member of a team only once
-    __table_args__ = (db.UniqueConstraint('team_id', 'user_id', name='_team_user_uc'),)
+    team = db.relationship('Team', back_populates='members')
+    user = db.relationship('User', lazy=True)
+    
+    __table_args__ = (
+        # To ensure a user can be a member of a team only once
+        db.UniqueConstraint('team_id', 'user_id', name='_team_user_uc'),
+        # A user's teams and their role in each, answered from the index alone
+        db.Index('ix_team_member_user_role', 'user_id', 'team_id', postgresql_include=['role']),
+    )
     
     def __repr__(self):
         return f'<TeamMember {self.user_id} in Team {self.team_id}>'
@@ -179,7 +352,10 @@ class TeamMember(db.Model):
 class TeamProject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     team_id = db.Column(db.Integer, db.ForeignKey('team.id'), nullable=False)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
+    
+    team = db.relationship('Team', back_populates='projects')
+    project = db.relationship('Project', lazy=True)
     
     # Ensure a project can be associated with a team only once
     __table_args__ = (db.UniqueConstraint('team_id', 'project_id', name='_team_project_uc'),)
@@ -190,7 +366,7 @@ class TeamProject(db.Model):
 # Model for project comments and feedback
 class ProjectComment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
     file_path = db.Column(db.String(255), nullable=True)  # Path to specific file if comment is file-specific
@@ -269,18 +445,25 @@ class Webhook(db.Model):
     description = db.Column(db.Text, nullable=True)
     url = db.Column(db.String(255), nullable=False)
     secret = db.Column(db.String(64), nullable=True)  # For signature verification
-    events = db.Column(db.Text, nullable=False)  # JSON array of event types
+    events = db.Column(JSONB, nullable=False)  # List of event types
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_triggered_at = db.Column(db.DateTime, nullable=True)
     failure_count = db.Column(db.Integer, default=0)
     
+    __table_args__ = (
+        db.Index('ix_webhook_events_gin', 'events', postgresql_using='gin',
+                 postgresql_ops={'events': 'jsonb_path_ops'}),
+        # Only active webhooks are ever dispatched
+        db.Index('ix_webhook_user_active', 'user_id', postgresql_where=db.text('is_active')),
+    )
+    
     def __repr__(self):
         return f'<Webhook {self.name}>'
 
 class WebhookEvent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    webhook_id = db.Column(db.Integer, db.ForeignKey('webhook.id'), nullable=False)
+    webhook_id = db.Column(db.Integer, db.ForeignKey('webhook.id'), nullable=False, index=True)
     event_type = db.Column(db.String(50), nullable=False)
     payload = db.Column(db.Text, nullable=False)  # JSON payload
     status = db.Column(db.String(20), default='pending')  # pending, sent, failed
@@ -298,10 +481,11 @@ class Integration(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     provider = db.Column(db.String(50), nullable=False)  # github, gitlab, jenkins, etc.
     name = db.Column(db.String(100), nullable=False)
-    config = db.Column(db.Text, nullable=False)  # JSON configuration
-    credentials = db.Column(db.Text, nullable=True)  # Encrypted credentials
+    config = db.Column(JSONB, nullable=False)  # JSON configuration
+    credentials = db.Column(db.LargeBinary, nullable=True)  # AES-GCM nonce + ciphertext
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_used_at = db.Column(db.DateTime, nullable=True)
     
     __table_args__ = (db.UniqueConstraint('user_id', 'provider', 'name', name='_user_provider_name_uc'),)
@@ -317,7 +501,7 @@ class HACFSession(db.Model):
     Tracks an active HACF processing session with enhanced framework features
     """
     id = db.Column(db.String(36), primary_key=True)  # UUID
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -8,6 +8,17 @@ from functools import wraps
 from typing import List, Dict, Any, Callable, Optional
 
 from flask import request, current_app, g
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -17,6 +28,79 @@ _memory_cache = {}
 _cache_expiry = {}
 _cache_lock = threading.RLock()
 
+# Shared Redis client (created lazily from REDIS_URL)
+_redis_client = None
+
+def get_redis_client():
+    """
+    Get the shared Redis client
+    Returns None when Redis is not installed or REDIS_URL is not configured,
+    so callers can fall back to the database.
+    """
+    global _redis_client
+    
+    if _redis_client is None and redis is not None:
+        redis_url = os.environ.get("REDIS_URL")
+        if redis_url:
+            with _cache_lock:
+                if _redis_client is None:
+                    _redis_client = redis.Redis.from_url(redis_url)
+    
+    return _redis_client
+
+def incr_window_counter(redis_client, key, window):
+    """
+    Increment a fixed-window counter in Redis and return the new count
+    The key is created with its expiry before it is counted, in one MULTI block,
+    so a counter can never be left behind without a TTL.
+    """
+    pipe = redis_client.pipeline()
+    pipe.set(key, 0, ex=window, nx=True)
+    pipe.incr(key)
+    _, count = pipe.execute()
+    return count
+
+def _json_default(obj):
+    """Encode dates as ISO-8601, matching orjson, and defer everything else to Flask"""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by orjson
+    orjson serializes datetimes natively, so views can pass them to jsonify
+    directly. Falls back to the stdlib encoder when orjson is not installed
+    or stdlib-only options such as indent are requested.
+    """
+    
+    default = staticmethod(_json_default)
+    
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            kwargs.setdefault("default", self.default)
+            return json.dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return json.loads(s, **kwargs)
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        
+        obj = self._prepare_response_obj(args, kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=option),
+            mimetype=self.mimetype
+        )
+
 class PerformanceMonitor:
     """Tracks and analyzes application performance metrics"""
     
@@ -174,15 +258,26 @@ def cache_result(expiry=300):
             
             # Call the function and cache the result
             result = func(*args, **kwargs)
-            
-            with _cache_lock:
-                _memory_cache[cache_key] = result
-                _cache_expiry[cache_key] = time.time() + expiry
+            set_cached(cache_key, result, expiry)
             
             return result
         return wrapper
     return decorator
 
+def get_cached(cache_key):
+    """Get a value from the memory cache, or None if missing or expired"""
+    with _cache_lock:
+        if cache_key in _memory_cache:
+            if cache_key not in _cache_expiry or _cache_expiry[cache_key] > time.time():
+                return _memory_cache[cache_key]
+    return None
+
+def set_cached(cache_key, value, expiry=300):
+    """Store a value in the memory cache for expiry seconds"""
+    with _cache_lock:
+        _memory_cache[cache_key] = value
+        _cache_expiry[cache_key] = time.time() + expiry
+
 def clear_cache(prefix=None):
     """
     Clear the memory cache
@@ -4,22 +4,36 @@ import time
 import json
 import logging
 import hashlib
+import hmac
 import secrets
+import base64
 import datetime
 import ipaddress
 from typing import List, Dict, Any, Optional, Tuple
 
 from flask import request, abort, current_app, g, session
-from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
+from functools import lru_cache, wraps
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from flask_login import current_user
 
 from app import db
 from models import User
+from performance import get_redis_client, incr_window_counter
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=1)
+def _secret_cipher(key: str) -> AESGCM:
+    """AES-256-GCM cipher from CREDENTIALS_ENCRYPTION_KEY (32 bytes, urlsafe base64)"""
+    try:
+        raw = base64.urlsafe_b64decode(key)
+    except ValueError:
+        raw = b''
+    if len(raw) != 32:
+        raise RuntimeError("CREDENTIALS_ENCRYPTION_KEY must be 32 bytes encoded as urlsafe base64")
+    return AESGCM(raw)
+
 class SecurityManager:
     """Manages security features and enhancements"""
     
@@ -43,12 +57,12 @@ class SecurityManager:
     @staticmethod
     def hash_password(password: str) -> str:
         """Hash a password for storage"""
-        return generate_password_hash(password)
+        return User.hash_password(password)
     
     @staticmethod
     def check_password(hashed_password: str, password: str) -> bool:
         """Check if a password matches its hash"""
-        return check_password_hash(hashed_password, password)
+        return User.verify_password(hashed_password, password)
     
     @staticmethod
     def validate_password_strength(password: str) -> Tuple[bool, str]:
@@ -80,6 +94,28 @@ class SecurityManager:
         """Generate a secure random token"""
         return secrets.token_urlsafe(32)
     
+    @staticmethod
+    def encrypt_secret(data: Any, context: str) -> bytes:
+        """Encrypt a JSON-serializable value with AES-GCM, bound to a context string"""
+        nonce = secrets.token_bytes(12)
+        plaintext = current_app.json.dumps(data).encode()
+        cipher = _secret_cipher(current_app.config["CREDENTIALS_ENCRYPTION_KEY"])
+        return nonce + cipher.encrypt(nonce, plaintext, context.encode())
+    
+    @staticmethod
+    def decrypt_secret(blob: bytes, context: str) -> Any:
+        """Decrypt a value produced by encrypt_secret with the same context"""
+        cipher = _secret_cipher(current_app.config["CREDENTIALS_ENCRYPTION_KEY"])
+        plaintext = cipher.decrypt(blob[:12], blob[12:], context.encode())
+        return current_app.json.loads(plaintext)
+    
+    @staticmethod
+    def verify_secret_encryption() -> None:
+        """Check at startup that the credentials key is usable by round-tripping a probe value"""
+        probe = {"probe": secrets.token_hex(8)}
+        if SecurityManager.decrypt_secret(SecurityManager.encrypt_secret(probe, "startup"), "startup") != probe:
+            raise RuntimeError("CREDENTIALS_ENCRYPTION_KEY failed the encryption round trip")
+    
     @staticmethod
     def generate_csrf_token(session_id: str) -> str:
         """Generate a CSRF token for a session"""
@@ -102,7 +138,10 @@ class SecurityManager:
             del SecurityManager._csrf_token_expiry[session_id]
             return False
         
-        return SecurityManager._csrf_tokens[session_id] == token
+        # Constant-time comparison so response timing doesn't leak the token
+        if not token:
+            return False
+        return hmac.compare_digest(SecurityManager._csrf_tokens[session_id].encode(), token.encode())
     
     @staticmethod
     def validate_input(input_data: Dict[str, Any], rules: Dict[str, Dict[str, Any]]) -> Tuple[bool, Dict[str, str]]:
@@ -386,6 +425,29 @@ def rate_limited(limit=60, window=60):
         return decorated_function
     return decorator
 
+# Per-user request counters for write endpoints, kept in Redis when available
+USER_RATE_LIMIT_KEY_PREFIX = 'rl:'
+
+def user_rate_limited(name, limit=30, window=60):
+    """
+    Decorator to limit how often each logged-in user may call an endpoint
+    Counts live in Redis so every worker shares them; without Redis this falls
+    back to the process-local SecurityManager.rate_limit counters.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            key = f"{USER_RATE_LIMIT_KEY_PREFIX}{name}:{current_user.get_id()}"
+            redis_client = get_redis_client()
+            if redis_client is not None:
+                if incr_window_counter(redis_client, key, window) > limit:
+                    abort(429)
+            elif not SecurityManager.rate_limit(key, limit, window):
+                abort(429)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
 def admin_required(f):
     """Decorator to restrict access to admin users"""
     @wraps(f)
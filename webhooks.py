@@ -29,14 +29,14 @@ class WebhookManager:
     def _trigger_webhook(user_id, event_type, payload):
         """Trigger webhooks for a specific event type (internal method)"""
         try:
-            webhooks = Webhook.query.filter_by(user_id=user_id, is_active=True).all()
+            webhooks = Webhook.query.filter(
+                Webhook.user_id == user_id,
+                Webhook.is_active,
+                Webhook.events.contains([event_type])
+            ).all()
             
             for webhook in webhooks:
                 try:
-                    events = json.loads(webhook.events)
-                    if event_type not in events:
-                        continue
-                    
                     # Create webhook event record
                     event = WebhookEvent(
                         webhook_id=webhook.id,
@@ -177,6 +177,7 @@ class WebhookEvents:
     TEAM_UPDATED = 'team.updated'
     TEAM_DELETED = 'team.deleted'
     TEAM_MEMBER_ADDED = 'team.member.added'
+    TEAM_MEMBERS_ADDED = 'team.members.added'
     TEAM_MEMBER_UPDATED = 'team.member.updated'
     TEAM_MEMBER_REMOVED = 'team.member.removed'
     